@@ -25,6 +25,7 @@ from importlib import import_module
 from treelib import Tree
 
 from util import create_registerer
+from path_index import PathIndex
 
 
 ENABLE_MAX_HINT = True
@@ -52,8 +53,74 @@ class NodeData:
 class ExecutionTree(Tree):
 
     def reset(self):
+        self.online_ops = None
+        self.pc_hit_costs = None
+        self.checkpoint_tiers = None
         for node in self.all_nodes_itr():
             node.data.reset()
+        if getattr(self, '_path_index', None) is not None:
+            self._path_index.reset()
+
+    def path_index(self):
+        """Shared PathIndex of this tree, built on first use and kept until the structure changes"""
+        if getattr(self, '_path_index', None) is None:
+            self._path_index = PathIndex(self)
+        return self._path_index
+
+    def graft(self, other):
+        """Add the nodes of other that this tree is missing, such as a newly audited version with the same
+        identifiers, and return the new leaves"""
+        leaves = []
+        for node in other.all_nodes_itr():
+            if self.contains(node.identifier):
+                continue
+            stack = [(node, other.parent(node.identifier))]
+            while stack:
+                new, parent = stack.pop()
+                self.create_node(new.tag, new.identifier, parent=parent.identifier,
+                                 data=NodeData(new.data.r_cost, new.data.c_size))
+                children = other.children(new.identifier)
+                if not children:
+                    leaves.append(self.get_node(new.identifier))
+                stack.extend((child, new) for child in reversed(children))
+        return leaves
+
+    def prune(self, targets):
+        """Tree with only the root paths of targets, given as nodes, identifiers or indices of leaves in DFS order.
+        Nodes keep their identifiers and costs and the tree keeps the cache size and deduplicated sizes."""
+        index = self.path_index()
+        keep = set()
+        for target in targets:
+            if isinstance(target, int):
+                target = index.leaves[target]
+            keep.update(node.identifier for node in index.path(self.get_node(getattr(target, 'identifier', target))))
+
+        tree = ExecutionTree()
+        tree.cache_size = getattr(self, 'cache_size', None)
+        tree.unique_sizes = getattr(self, 'unique_sizes', None)
+        tree.dedup = getattr(self, 'dedup', False)
+        stack = [(self.get_node(self.root), None)]
+        while stack:
+            node, parent = stack.pop()
+            tree.create_node(node.tag, node.identifier, parent=parent,
+                             data=NodeData(node.data.r_cost, node.data.c_size))
+            stack.extend((child, node.identifier) for child in reversed(self.children(node.identifier))
+                         if child.identifier in keep)
+        return tree
+
+    def order_children(self, node, children):
+        """Replay the children of node in the given order"""
+        assert set(children) == set(self.children(node.identifier))
+        node.set_successors([child.identifier for child in children], tree_id=self.identifier)
+        self._path_index = None
+
+    def add_node(self, node, parent=None):
+        self._path_index = None
+        super().add_node(node, parent)
+
+    def remove_node(self, identifier):
+        self._path_index = None
+        return super().remove_node(identifier)
 
     def __sizeof__(self):
         return sum(sys.getsizeof(node.data)
@@ -157,15 +224,18 @@ def sciunit_tree_creator(tree_binary, sciunit_tree_module_path='sciunit_tree'):
 
     tree = ExecutionTree()
 
-    def recursive_fill(node, parent=None):
-        tree.create_node(node.hash, node.hash, parent=parent.hash if parent else None,
-                         data=NodeData(node.time, node.size))
-        for child in node.children:
-            recursive_fill(node.children[child], node)
-
     sciunit_execution_tree.time = 0
     sciunit_execution_tree.size = float('inf')
-    recursive_fill(sciunit_execution_tree)
+    # Bytes each checkpoint does not share with its parent's, for trees audited with page hashes
+    tree.unique_sizes = {}
+    stack = [(sciunit_execution_tree, None)]
+    while stack:
+        node, parent = stack.pop()
+        tree.create_node(node.hash, node.hash, parent=parent.hash if parent else None,
+                         data=NodeData(node.time, node.size))
+        if getattr(node, 'unique_size', None) is not None:
+            tree.unique_sizes[node.hash] = node.unique_size
+        stack.extend((node.children[child], node) for child in reversed(node.children))
     return tree
 
 
@@ -175,14 +245,12 @@ def sciunit_tree_creator(chex_execution_tree):
     tree = ExecutionTree()
     count = 0
 
-    def recursive_fill(node, parent=None):
-        nonlocal count
+    stack = [(chex_execution_tree.root, None)]
+    while stack:
+        node, parent = stack.pop()
         node.hash = f'n{count}'
         count += 1
         tree.create_node(node.hash, node.hash, parent=parent.hash if parent else None,
                          data=NodeData(node.c, node.s))
-        for child in node.children:
-            recursive_fill(child, node)
-
-    recursive_fill(chex_execution_tree.root)
+        stack.extend((child, node) for child in reversed(node.children))
     return tree
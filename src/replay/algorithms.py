@@ -15,156 +15,1039 @@
 #
 # Author: Naga Nithin Manne <nithinmanne@gmail.com>
 
-# File purpose: Implementations of the non-MINLP algorithms PC, PRP and LFU.
+# File purpose: Implementations of the non-MINLP algorithms PC, PRP, the cache policies, branch-and-bound
+# and local search.
 # Usage: For Bob to generate replay sequences using the mentioned algorithms.
 
 import sys
-from util import dfs_cost, paths_to_leaves, checkpoints_restores
+import math
+import time
+import random
+import heapq
+from util import cost, leaf_finish, dfs_cost, dfs_io_cost, dfs_gain, dfs_cache, dfs_uncache, \
+    checkpoints_restores, quantize, dump_cost, restore_cost, plan_io_cost, plan_size, plan_unique, \
+    plan_budget, plan_key, child_caches, run_recursion, post_order, export_plans, import_plans, paused_gc, \
+    replay_ops, replay_time, export_walked_plans, IOCost
+import ExecutionTree as exT
+from memo import BoundedMemo
+from policies import online
 from itertools import count
-from collections import defaultdict as ddict
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict as ddict, namedtuple
 
 
-def _check_constraints(ex_tree, node, paths):
-    """Check if any cache constraints are violated along the paths where the node is present"""
-    for path in paths:
-        if node.identifier in path:
-            path_nodes = map(lambda path_node: ex_tree.get_node(path_node).data, path)
-            if sum(path_node.c_size for path_node in path_nodes if path_node.x_in_cache) > ex_tree.cache_size:
-                return False
-    return True
+def _prp_lazy(ex_tree, nodes, index, gain_key, total_cost):
+    """Lazy greedy (CELF) selection, re-evaluating only the candidates that reach the top of the heap.
+    gain_key ranks a candidate by its marginal saving and the current total cost, and grows with the saving.
+    Marginal savings never grow once other nodes are cached, so a key from a stale saving is an upper bound
+    and an entry that is still on top after being refreshed in the current round is the best candidate.
+    The heap is rebuilt from the stale savings after every pick, since the total cost changed."""
+    tie_breaker = count()
+    savings = {node: dfs_gain(ex_tree, node) for node in nodes}
+    fresh = set(savings)
+    while savings:
+        heap = [(-gain_key(saving, node, total_cost), next(tie_breaker), node) for node, saving in savings.items()]
+        heapq.heapify(heap)
+        while heap:
+            _, _, node = heapq.heappop(heap)
+            if not index.fits(node):
+                # Cache usage only grows, so the node can never fit again
+                del savings[node]
+            elif node not in fresh:
+                savings[node] = dfs_gain(ex_tree, node)
+                fresh.add(node)
+                heapq.heappush(heap, (-gain_key(savings[node], node, total_cost), next(tie_breaker), node))
+            elif savings[node] < 0:
+                # Only dumps and restores make a node a loss, and it stays one
+                del savings[node]
+            else:
+                break
+        else:
+            break
+        dfs_cache(ex_tree, node)
+        index.add(node)
+        total_cost -= savings.pop(node)
+        fresh = set()
 
 
-def prp(ex_tree, cost_compare, verbose=False):
-    """General purpose algorithm for DFS using a custom cost comparison function"""
-    paths = ex_tree.paths_to_leaves()
+def prp(ex_tree, cost_compare, verbose=False, gain_key=None):
+    """General purpose algorithm for DFS using a custom cost comparison function,
+    or lazily using the marginal saving ranked by gain_key when given.
+    Savings are net of dumps and restores under ex_tree.cost_model, and nodes that would lose time are skipped."""
+    index = ex_tree.path_index()
     nodes = set(ex_tree.filter_nodes(lambda tree_node: not tree_node.is_leaf()))
+    # y values are kept up to date by dfs_cache, so each candidate only walks its ancestor chain
+    total_cost = dfs_cost(ex_tree)
 
-    while True:
-        min_node, min_cost = None, float('inf')
-        for node in nodes:
-            node.data.x_in_cache = True
-            if _check_constraints(ex_tree, node, paths):
-                if cost_compare(new_cost := dfs_cost(ex_tree), node, min_cost, min_node):
-                    min_node, min_cost = node, new_cost
-            node.data.x_in_cache = False
-        if not min_node:
-            break
-        min_node.data.x_in_cache = True
-        nodes.remove(min_node)
+    if gain_key is not None:
+        _prp_lazy(ex_tree, nodes, index, gain_key, total_cost)
+    else:
+        while True:
+            min_node, min_cost = None, float('inf')
+            for node in nodes:
+                if index.fits(node) and (gain := dfs_gain(ex_tree, node)) >= 0:
+                    if cost_compare(new_cost := total_cost - gain, node, min_cost, min_node):
+                        min_node, min_cost = node, new_cost
+            if not min_node:
+                break
+            dfs_cache(ex_tree, min_node)
+            index.add(min_node)
+            total_cost = min_cost
+            nodes.remove(min_node)
     if verbose:
         ex_tree.show(data_property='x_in_cache')
 
 
-def prp_v1(ex_tree, verbose=False):
+def prp_v1(ex_tree, verbose=False, lazy=False):
     """Run DFS algorithm by comparing just time saved in each iteration"""
-    return prp(ex_tree, lambda new_cost, new_node, min_cost, min_node: new_cost < min_cost, verbose)
+    return prp(ex_tree, lambda new_cost, new_node, min_cost, min_node: new_cost < min_cost, verbose,
+               gain_key=(lambda saving, node, total_cost: saving) if lazy else None)
 
 
-def prp_v2(ex_tree, verbose=False):
+def prp_v2(ex_tree, verbose=False, lazy=False):
     """Run DFS algorithm by comparing time saved per cache usage in each iteration"""
     def cost_compare(new_cost, new_node, min_cost, min_node):
         if min_node is None:
             return True
         return (new_cost / new_node.data.c_size) < (min_cost / min_node.data.c_size)
-    return prp(ex_tree, cost_compare, verbose)
+    # Lazily, the lowest new cost per byte is the highest (saving - total cost) per byte
+    return prp(ex_tree, cost_compare, verbose,
+               gain_key=(lambda saving, node, total_cost: (saving - total_cost) / node.data.c_size) if lazy
+               else None)
 
 
-def pc(ex_tree, verbose=False):
+def _pc_decide(node, cache, parent_cost, cacheable, children, costs, verbose=False, dump=0, restore=0, redo=None):
+    """Plan and cost of node given the costs PC's recursion found for its children, in the order it asks.
+    If node fits in cache, costs alternate between each child with node in cache and without it.
+    dump and restore are the times to dump and restore node's checkpoint, a child keeps it if that saves
+    more than both, and redo the time to get node back otherwise, recomputing it after its parent by default.
+    The cost charges the checkpoint I/O as replayed, see util.plan_io_cost."""
+    if redo is None:
+        redo = node.data.r_cost + parent_cost
+    io = dump + restore
+    total_cost = node.data.r_cost
+    plan = [(node, False)]
+    with_extra_cache, without_extra_cache = [], []
 
-    def recurse(node, cache, parent_cost=0):
-        if cache in node.data.recursive_cache:
-            return sum(recurse(cache_node, cache - (node.data.c_size if cached else 0))
-                       if cache_node != node
-                       else node.data.r_cost
-                       for cache_node, cached in node.data.recursive_cache[cache])
+    if not cacheable:
+        with_extra_cache = list(zip(costs, children))
+    else:
+        tie_breaker = count()
+        for child, less_cache_cost, more_cache_cost in zip(children, costs[::2], costs[1::2]):
+            if less_cache_cost + io - more_cache_cost <= redo:
+                without_extra_cache.append((less_cache_cost + io - more_cache_cost, next(tie_breaker),
+                                            less_cache_cost, more_cache_cost, child))
+            else:
+                with_extra_cache.append((more_cache_cost, child))
 
-        node.data.recursive_cache[cache] = [(node, False)]
-        total_cost = node.data.r_cost
+    if verbose:
+        print(node, cache)
+        print('without_extra_cache', *without_extra_cache, sep='\n')
+        print('with_extra_cache', *with_extra_cache, sep='\n')
 
-        if node.is_leaf():
-            return total_cost
+    if without_extra_cache:
+        plan[0] = (node, True)
+        without_extra_cache.sort()
+        # Process items where all use parent in cache
+        for _, _, less_cache_cost, _, child in without_extra_cache:
+            plan.append((child, True))
+            total_cost += less_cache_cost
 
-        with_extra_cache, without_extra_cache = [], []
+    if with_extra_cache:
+        # For first child, skip re-computation
+        first = True
+        # Process children by recomputing parent
+        for more_cache_cost, child in with_extra_cache:
+            if first:
+                first = False
+            else:
+                plan.append((node, False))
+                total_cost += redo
+            plan.append((child, False))
+            total_cost += more_cache_cost
+    else:
+        # Use cache for last without cache if nothing else exists
+        _, _, less_cache_cost, more_cache_cost, child = without_extra_cache[-1]
+        plan[-1] = (child, False)
+        total_cost += more_cache_cost - less_cache_cost
 
-        if cache < node.data.c_size:
-            for child in ex_tree.children(node.identifier):
-                with_extra_cache.append((recurse(child, cache, node.data.r_cost + parent_cost), child))
+    return plan, total_cost + (plan_io_cost(plan, dump, restore) if dump or restore else 0)
+
+
+def _pc_run(ex_tree, cache, sizes, hit_costs, verbose=False, parent_cost=None, uniques=None, budget=None,
+            root=None, fresh=None):
+    """Run PC from root, the tree's root by default, with the given cache, filling recursive_cache and hit_costs,
+    and return the cost PC finds for it.
+    A plan is made on the first call for its node and cache, and hit_costs keeps it by node and cache as
+    (cost of that call, hit cost). Like the recursive PC, a later call is answered with the hit cost, the cost
+    of replaying the plan with nothing to pay for its parent, so PC decides on the same costs it always did.
+    The replay pays the parent cost, so the time to replay the plans is _pc_cost's, not this one.
+    fresh holds keys another run planned for their first call, which they answer once with its cost.
+    uniques holds the deduplicated sizes of plan_unique, accounted from budget, the root cache by default.
+    parent_cost is the time to get root's parent, by default restoring the tree root's image is charged."""
+    with_io = getattr(ex_tree, 'cost_model', None) is not None
+    budget = cache if budget is None else budget
+    root = root or ex_tree.get_node(ex_tree.root)
+    fresh = set() if fresh is None else fresh
+    # Without a parent cost, root is the tree's root, whose image the replay restores before running it
+    start_cost = restore_cost(ex_tree, root) if parent_cost is None and with_io else 0
+
+    def recurse(node, cache, parent_cost=0):
+        # Sub-problems are yielded to run_recursion rather than called, so deep trees do not hit the
+        # recursion limit. Existing plans are answered by known_cost without a new frame.
+        # Both answer with the cost of the call and the hit cost of the plan.
+        children = ex_tree.children(node.identifier)
+        if not children:
+            plan, total_cost, hit_cost = [(node, False)], node.data.r_cost, node.data.r_cost
         else:
-            tie_breaker = count()
+            with_node, without_node = child_caches(cache, budget, sizes[node], uniques and uniques[node])
+            dump, restore = (dump_cost(ex_tree, node), restore_cost(ex_tree, node)) if with_io else (0, 0)
+            redo = node.data.r_cost + parent_cost
+            costs, hits, cacheable = [], {}, with_node is not None
+            for child in children:
+                if cacheable:
+                    child_cost, hits[child, True] = yield child, with_node, restore
+                    costs.append(child_cost)
+                child_cost, hits[child, False] = yield child, without_node, redo
+                costs.append(child_cost)
+            plan, total_cost = _pc_decide(node, cache, parent_cost, cacheable, children, costs, verbose, dump,
+                                          restore, redo)
+            # Every run of node is paid as is, and every child with its own hit cost
+            hit_cost = ((plan_io_cost(plan, dump, restore) if dump or restore else 0)
+                        + sum(node.data.r_cost if child is node else hits[child, cached] for child, cached in plan))
+        node.data.recursive_cache[cache] = plan
+        hit_costs[node, cache] = total_cost, hit_cost
+        return total_cost, hit_cost
+
+    def known_cost(node, cache, parent_cost=0):
+        known = hit_costs.get((node, cache))
+        if known is None:
+            return None
+        if (node, cache) in fresh:
+            fresh.discard((node, cache))
+            return known
+        return known[1], known[1]
+
+    # Every plan and its costs are kept, so collecting while they are made only walks them again and again
+    with paused_gc():
+        total_cost, _ = run_recursion(recurse, root, cache, start_cost if parent_cost is None else parent_cost,
+                                      shortcut=known_cost)
+    return start_cost + total_cost
+
+
+def _pc_cost(ex_tree, cache, sizes, uniques=None, parent_cost=None, budget=None, root=None, plan_of=None):
+    """Time to replay the plans from root like util.replay_time, walking every plan once.
+    plan_of(node, cache, parent_cost) gives the plan of a sub-problem, its recursive_cache entry by default.
+    The other arguments are those of the _pc_run that made the plans."""
+    with_io = getattr(ex_tree, 'cost_model', None) is not None
+    budget = cache if budget is None else budget
+    root = root or ex_tree.get_node(ex_tree.root)
+    start_cost = restore_cost(ex_tree, root) if parent_cost is None and with_io else 0
+    total_cost = start_cost
+    stack = [(root, cache, start_cost if parent_cost is None else parent_cost)]
+    while stack:
+        node, cache, parent_cost = stack.pop()
+        plan = plan_of(node, cache, parent_cost) if plan_of else node.data.recursive_cache[cache]
+        with_node, without_node = child_caches(cache, budget, sizes[node], uniques and uniques[node])
+        dump, restore = (dump_cost(ex_tree, node), restore_cost(ex_tree, node)) if with_io else (0, 0)
+        redo = node.data.r_cost + parent_cost
+        total_cost += node.data.r_cost + plan_io_cost(plan, dump, restore)
+        for child, cached in plan[1:]:
+            if child is node:
+                total_cost += redo
+            else:
+                stack.append((child, with_node if cached else without_node, restore if cached else redo))
+    return total_cost
+
+
+def _pc_pin(ex_tree, cache, sizes, verbose=False, uniques=None):
+    """Move the plans the replay walks from ex_tree.memo into plain recursive_cache dicts, planning again the
+    ones it evicted, and return their cost like _pc_cost. Plans are the same as _pc_run's unless a sub-problem
+    was evicted and planned again for another parent cost, so the cost is that of the pinned plans."""
+    plans = {}
+
+    def plan_of(node, node_cache, parent_cost):
+        plan = ex_tree.memo.plan(node, node_cache)
+        if plan is None:
+            _pc_run(ex_tree, node_cache, sizes, ex_tree.memo, verbose, parent_cost, uniques, cache, node)
+            plan = ex_tree.memo.plan(node, node_cache)
+        plans[node] = node_cache, plan
+        return plan
+
+    total_cost = _pc_cost(ex_tree, cache, sizes, uniques, plan_of=plan_of)
+    for node in ex_tree.all_nodes_itr():
+        node.data.recursive_cache = {}
+    for node, (node_cache, plan) in plans.items():
+        node.data.recursive_cache[node_cache] = plan
+    return total_cost
+
+
+def _pc_cut(ex_tree, cutoff_depth, min_subtree):
+    """Roots of the sub-trees at cutoff_depth with at least min_subtree nodes, and the nodes above them"""
+    subtree_size = {}
+    for node in post_order(ex_tree):
+        subtree_size[node] = 1 + sum(subtree_size[child] for child in ex_tree.children(node.identifier))
+    top = set()
+    level = [ex_tree.get_node(ex_tree.root)]
+    for _ in range(cutoff_depth):
+        top.update(level)
+        level = [child for node in level for child in ex_tree.children(node.identifier)]
+    cut = [node for node in level if subtree_size[node] >= min_subtree]
+    return top, cut
+
+
+def _pc_calls(ex_tree, cache, sizes, top, cut, uniques=None):
+    """First calls PC makes into every cut sub-tree, in order, as (cache, parent_cost) pairs.
+    Which sub-problems PC visits first does not depend on their costs, since a memo hit only
+    revisits sub-problems its creation already visited, so this walks the top of the tree only."""
+    calls = {node: [] for node in cut}
+    visited = set()
+
+    def visit(node, cache, parent_cost=0):
+        if (node, cache) in visited:
+            return
+        visited.add((node, cache))
+        if node in calls:
+            calls[node].append((cache, parent_cost))
+        elif node in top:
+            with_node, without_node = child_caches(cache, budget, sizes[node], uniques and uniques[node])
             for child in ex_tree.children(node.identifier):
-                less_cache_cost = recurse(child, cache - node.data.c_size)
-                more_cache_cost = recurse(child, cache, node.data.r_cost + parent_cost)
-                if less_cache_cost - more_cache_cost <= node.data.r_cost + parent_cost:
-                    without_extra_cache.append((less_cache_cost - more_cache_cost, next(tie_breaker),
-                                                less_cache_cost, child))
-                else:
-                    with_extra_cache.append((more_cache_cost, child))
+                if with_node is not None:
+                    yield child, with_node, restore_cost(ex_tree, node) if with_io else 0
+                yield child, without_node, node.data.r_cost + parent_cost
 
-        if verbose:
-            print(node, cache)
-            print('without_extra_cache', *without_extra_cache, sep='\n')
-            print('with_extra_cache', *with_extra_cache, sep='\n')
-
-        if without_extra_cache:
-            node.data.recursive_cache[cache][0] = (node, True)
-            without_extra_cache.sort()
-            # Process items where all use parent in cache
-            for _, _, less_cache_cost, child in without_extra_cache:
-                node.data.recursive_cache[cache].append((child, True))
-                total_cost += less_cache_cost
-
-        if with_extra_cache:
-            # For first child, skip re-computation
-            first = True
-            # Process children by recomputing parent
-            for more_cache_cost, child in with_extra_cache:
-                if first:
-                    first = False
-                else:
-                    node.data.recursive_cache[cache].append((node, False))
-                    total_cost += node.data.r_cost + parent_cost
-                node.data.recursive_cache[cache].append((child, False))
-                total_cost += more_cache_cost
+    budget = cache
+    with_io = getattr(ex_tree, 'cost_model', None) is not None
+    root = ex_tree.get_node(ex_tree.root)
+    run_recursion(visit, root, cache, restore_cost(ex_tree, root) if with_io else 0)
+    return calls
+
+
+def _pc_subtree(records, calls, verbose=False, cost_model=None, budget=None):
+    """Solve the calls into one sub-tree, given as (identifier, parent, r_cost, c_size, size, unique) records
+    in pre-order. Returns the cost of every call, which makes its plan, and the sub-tree's plans."""
+    ex_tree = exT.ExecutionTree()
+    ex_tree.cost_model = cost_model
+    sizes, uniques = {}, {}
+    for identifier, parent, r_cost, c_size, size, unique in records:
+        node = ex_tree.create_node(identifier=identifier, parent=parent, data=exT.NodeData(r_cost, c_size))
+        sizes[node], uniques[node] = size, unique
+    if any(unique is None for unique in uniques.values()):
+        uniques = None
+    hit_costs = {}
+    for cache, parent_cost in calls:
+        _pc_run(ex_tree, cache, sizes, hit_costs, verbose, parent_cost, uniques=uniques, budget=budget)
+    return {(node.identifier, cache): known for (node, cache), known in hit_costs.items()}, export_plans(ex_tree)
+
+
+def _pc_run_parallel(ex_tree, cache, sizes, verbose, workers, cutoff_depth, min_subtree, uniques=None):
+    """Run PC like _pc_run, solving the large sub-trees at cutoff_depth in a process pool"""
+    top, cut = _pc_cut(ex_tree, cutoff_depth, min_subtree)
+    if not cut:
+        return _pc_run(ex_tree, cache, sizes, {}, verbose, uniques=uniques)
+    calls = _pc_calls(ex_tree, cache, sizes, top, cut, uniques)
+
+    def records(root):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            parent = None if node is root else ex_tree.parent(node.identifier).identifier
+            yield (node.identifier, parent, node.data.r_cost, node.data.c_size, sizes[node],
+                   uniques and uniques[node])
+            stack.extend(reversed(ex_tree.children(node.identifier)))
+
+    hit_costs = {}
+    # Results are unpickled on the pool's own thread, so collection stays paused while they arrive
+    with paused_gc(), ProcessPoolExecutor(workers) as pool:
+        solved = pool.map(_pc_subtree, [list(records(node)) for node in cut], [calls[node] for node in cut],
+                          [verbose] * len(cut), [getattr(ex_tree, 'cost_model', None)] * len(cut),
+                          [cache] * len(cut))
+        for subtree_hit_costs, plans in solved:
+            import_plans(ex_tree, plans)
+            hit_costs.update(((ex_tree.get_node(identifier), node_cache), known)
+                             for (identifier, node_cache), known in subtree_hit_costs.items())
+    # Calls into the sub-trees are answered with the costs of their imported plans, the first one of each
+    # with the cost the sub-tree's run found for it
+    return _pc_run(ex_tree, cache, sizes, hit_costs, verbose, uniques=uniques,
+                   fresh={(node, node_cache) for node in cut for node_cache, _ in calls[node]})
+
+
+def pc(ex_tree, verbose=False, granularity=None, workers=None, cutoff_depth=1, min_subtree=1000, memo_limit=None,
+       incremental=False):
+    """Run PC, optionally on cache sizes quantized to multiples of granularity.
+    Checkpoint sizes are rounded up and the budget down, so the plan stays within the exact budget
+    and the memo holds at most cache_size / granularity entries per node. The cost difference to a
+    run with sizes rounded down and the budget rounded up is kept as ex_tree.quantization_estimate.
+    It is a heuristic estimate of what quantizing costs, not a bound, since PC is not optimal and its
+    cost does not always drop with more room, so it can even be negative.
+    Plans are decided on the costs of the recursive PC, see _pc_run, and ex_tree.total_cost is the time
+    to replay them, see util.replay_time.
+    With workers, sub-trees at cutoff_depth with at least min_subtree nodes are solved in that many
+    processes, and the plan is identical to the plain one. With memo_limit, at most that many sub-problems are
+    kept in memory, with counters in ex_tree.memo. An evicted one is planned again when called, for the parent
+    cost of that call, so a limit below the plain run's plan count can change the plan and costs time.
+    With incremental, the cost of every plan is kept so pc_extend can update the plan for new paths.
+    With ex_tree.dedup, checkpoints are accounted by their unique bytes, see util.child_caches."""
+    assert not (workers and memo_limit)
+    assert not (incremental and (workers or memo_limit))
+    ex_tree.granularity = granularity
+    ex_tree.memo = None
+
+    def run(cache, sizes, uniques):
+        if workers:
+            _pc_run_parallel(ex_tree, cache, sizes, verbose, workers, cutoff_depth, min_subtree, uniques)
+        elif memo_limit:
+            ex_tree.memo = BoundedMemo(ex_tree, memo_limit)
+            _pc_run(ex_tree, cache, sizes, ex_tree.memo, verbose, uniques=uniques)
+            return _pc_pin(ex_tree, cache, sizes, verbose, uniques)
+        elif incremental:
+            ex_tree.pc_hit_costs = {}
+            _pc_run(ex_tree, cache, sizes, ex_tree.pc_hit_costs, verbose, uniques=uniques)
         else:
-            # Use cache for last without cache if nothing else exists
-            diff, _, _, child = without_extra_cache[-1]
-            node.data.recursive_cache[cache][-1] = (child, False)
-            total_cost -= diff
+            _pc_run(ex_tree, cache, sizes, {}, verbose, uniques=uniques)
+        return _pc_cost(ex_tree, cache, sizes, uniques)
 
-        return total_cost
+    if granularity:
+        optimistic_cost = run(quantize(ex_tree.cache_size, granularity),
+                              {node: quantize(node.data.c_size, granularity, math.floor)
+                               for node in ex_tree.all_nodes_itr()},
+                              _plan_uniques(ex_tree, math.floor))
+        ex_tree.reset()
 
-    total_cost_ret = recurse(ex_tree.get_node(ex_tree.root), ex_tree.cache_size)
+    total_cost_ret = run(plan_budget(ex_tree), {node: plan_size(ex_tree, node) for node in ex_tree.all_nodes_itr()},
+                         _plan_uniques(ex_tree))
     if verbose:
         ex_tree.show(data_property='recursive_cache')
         print(f'{total_cost_ret=}')
+    ex_tree.quantization_estimate = total_cost_ret - optimistic_cost if granularity else 0
+    ex_tree.total_cost = total_cost_ret
+    ex_tree.map_size = sys.getsizeof(ex_tree.memo or ex_tree)
+    ex_tree.c_r = checkpoints_restores(ex_tree)
+    return total_cost_ret
+
+
+def _plan_uniques(ex_tree, rounding=math.ceil):
+    """plan_unique of every node, None unless ex_tree.dedup is set"""
+    if not getattr(ex_tree, 'dedup', False):
+        return None
+    return {node: plan_unique(ex_tree, node, rounding) for node in ex_tree.all_nodes_itr()}
+
+
+def pc_extend(ex_tree, leaves, verbose=False):
+    """Update a plan from pc(ex_tree, incremental=True) after the paths to leaves were added to the tree.
+    Only the plans of nodes on those paths are redone. Calls to their other children are answered with the
+    kept costs of those plans, and the rest of the memo is reused as is. The plan is identical to a full run
+    of PC on the extended tree."""
+    assert getattr(ex_tree, 'pc_hit_costs', None) is not None, 'Run pc with incremental=True first'
+    index = ex_tree.path_index()
+    # The root is planned again by any run, so it is on the chain even without new leaves
+    chain = {ex_tree.get_node(ex_tree.root)}
+    chain.update(node for leaf in leaves for node in index.path(ex_tree.get_node(getattr(leaf, 'identifier', leaf))))
+    for node in chain:
+        node.data.recursive_cache = {}
+    ex_tree.pc_hit_costs = {key: known for key, known in ex_tree.pc_hit_costs.items() if key[0] not in chain}
+    # A full run makes the plans of the other children of the chain on the same first calls
+    fresh = {key for key in ex_tree.pc_hit_costs if ex_tree.parent(key[0].identifier) in chain}
+    sizes = {node: plan_size(ex_tree, node) for node in ex_tree.all_nodes_itr()}
+    budget, uniques = plan_budget(ex_tree), _plan_uniques(ex_tree)
+    _pc_run(ex_tree, budget, sizes, ex_tree.pc_hit_costs, verbose, uniques=uniques, fresh=fresh)
+    total_cost_ret = _pc_cost(ex_tree, budget, sizes, uniques)
+    if verbose:
+        print(f'{total_cost_ret=} replanned {len(chain)} nodes')
     ex_tree.total_cost = total_cost_ret
     ex_tree.map_size = sys.getsizeof(ex_tree)
     ex_tree.c_r = checkpoints_restores(ex_tree)
     return total_cost_ret
 
 
+class _PlanOnDemand(dict):
+    """recursive_cache of a node whose sub-tree is planned by solve the first time one of its plans is read"""
+
+    def __init__(self, solve):
+        super().__init__()
+        self.solve = solve
+
+    def __missing__(self, cache):
+        self.solve(cache)
+        return self[cache]
+
+
+def pc_stream(ex_tree, verbose=False, lookahead=10000):
+    """Plan ex_tree and yield the steps to replay it like util.replay_ops, starting before the whole plan is made.
+    A tree of at most lookahead nodes is planned with PC up front, so it replays exactly like PC's plan.
+    Otherwise the nodes down to the first one with several children get their plans up front. That node is kept
+    in cache for all but its last child if it fits and its dump and restore take less than redoing it. Then every
+    child's sub-tree is planned with PC only once the replay reaches it, so the plan below it is the same as PC's,
+    but the sub-trees do not share the cache the way PC would share it, which can cost much more than PC's plan.
+    The total cost and checkpoint count are set on ex_tree once every step was yielded."""
+    if len(ex_tree) <= lookahead:
+        pc(ex_tree, verbose)
+        yield from replay_ops(ex_tree)
+        return
+    ex_tree.granularity = None
+    ex_tree.memo = None
+    budget = plan_budget(ex_tree)
+    sizes = {node: plan_size(ex_tree, node) for node in ex_tree.all_nodes_itr()}
+    uniques = _plan_uniques(ex_tree)
+    with_io = getattr(ex_tree, 'cost_model', None) is not None
+    node, cache = ex_tree.get_node(ex_tree.root), budget
+    # The replay restores the root's image first, like _pc_run charges
+    redo = restore_cost(ex_tree, node) if with_io else 0
+    ex_tree.total_cost = redo
+    while len(ex_tree.children(node.identifier)) == 1:
+        child, = ex_tree.children(node.identifier)
+        node.data.recursive_cache[cache] = [(node, False), (child, False)]
+        ex_tree.total_cost += node.data.r_cost
+        redo = node.data.r_cost + redo
+        node, cache = child, plan_key(ex_tree, node, cache, False)
+    children = ex_tree.children(node.identifier)
+    if not children:
+        node.data.recursive_cache[cache] = [(node, False)]
+        ex_tree.total_cost += node.data.r_cost
+        yield from replay_ops(ex_tree)
+        ex_tree.c_r = 0
+        return
+
+    dump, restore = (dump_cost(ex_tree, node), restore_cost(ex_tree, node)) if with_io else (0, 0)
+    redo = node.data.r_cost + redo
+    kept = plan_key(ex_tree, node, cache, True) is not None and dump + restore <= redo
+    plan = [(node, kept)]
+    for child in children[:-1]:
+        plan.extend([(child, True)] if kept else [(child, False), (node, False)])
+    plan.append((children[-1], False))
+    node.data.recursive_cache[cache] = plan
+    ex_tree.total_cost += node.data.r_cost + (plan_io_cost(plan, dump, restore) if kept
+                                              else (len(children) - 1) * redo)
+    if verbose:
+        print(f'{node} {kept=} for {len(children)} children')
+
+    def solver(child, parent_cost):
+        def solve(child_cache):
+            _pc_run(ex_tree, child_cache, sizes, {}, verbose, parent_cost, uniques=uniques, budget=budget,
+                    root=child)
+            ex_tree.total_cost += _pc_cost(ex_tree, child_cache, sizes, uniques, parent_cost, budget, child)
+        return solve
+
+    for child, cached in node.data.recursive_cache[cache][1:]:
+        if child is not node:
+            child.data.recursive_cache = _PlanOnDemand(solver(child, restore if cached else redo))
+    yield from replay_ops(ex_tree)
+    # Plain plans again, so the planned tree can be pickled like one from pc
+    for child in children:
+        child.data.recursive_cache = dict(child.data.recursive_cache)
+    ex_tree.c_r = checkpoints_restores(ex_tree)
+    if verbose:
+        print(f'{ex_tree.total_cost=}')
+
+
+# plans are the PC plans of the point in the form of util.export_plans, for the planners that keep them
+FrontierPoint = namedtuple('FrontierPoint', 'cache_size total_cost c_r plans', defaults=(None,))
+
+
+def full_cache_size(ex_tree):
+    """Cache size with room for every node along any path, beyond which no plan changes"""
+    need = {}
+    for node in post_order(ex_tree):
+        children = ex_tree.children(node.identifier)
+        size = node.data.c_size if children and not math.isinf(node.data.c_size) else 0
+        need[node] = size + max((need[child] for child in children), default=0)
+    return need[ex_tree.get_node(ex_tree.root)]
+
+
+def pc_frontier(ex_tree, budgets, verbose=False, granularity=None):
+    """PC's plan for every budget, in the order given, as FrontierPoints, with one memo for all of them.
+    A sub-problem is a node and the cache left for it, whatever the budget, so a budget reuses the plans that
+    the ones before it made. A plan is made on its first call as in a single run of PC, but that call can come
+    from an earlier budget with another parent cost, so a point can differ from pc on its budget alone.
+    With granularity, sizes and budgets are quantized like in pc, which puts every budget's sub-problems on the
+    same grid and shares more of them. Every point keeps the plans its replay walks, which import_plans brings
+    back with cache_size set to the point's. total_cost is the time to replay them, like pc's.
+    With ex_tree.dedup the cache left depends on the budget, so every budget is planned on its own.
+    The tree is left reset."""
+    if getattr(ex_tree, 'dedup', False):
+        points = []
+        for budget in budgets:
+            ex_tree.cache_size = budget
+            pc(ex_tree, verbose, granularity)
+            points.append(FrontierPoint(budget, ex_tree.total_cost, ex_tree.c_r, export_walked_plans(ex_tree)))
+            ex_tree.reset()
+        return points
+    ex_tree.reset()
+    ex_tree.granularity = granularity
+    ex_tree.memo = None
+    sizes = {node: plan_size(ex_tree, node) for node in ex_tree.all_nodes_itr()}
+    hit_costs, points = {}, []
+    for budget in budgets:
+        ex_tree.cache_size = budget
+        cache = plan_budget(ex_tree)
+        _pc_run(ex_tree, cache, sizes, hit_costs, verbose)
+        points.append(FrontierPoint(budget, _pc_cost(ex_tree, cache, sizes), checkpoints_restores(ex_tree),
+                                    export_walked_plans(ex_tree)))
+        if verbose:
+            print(points[-1][:3], f'{len(hit_costs)} sub-problems')
+    ex_tree.reset()
+    return points
+
+
+def min_cache_size(ex_tree, target_cost=None, fraction=None, granularity=None, verbose=False):
+    """Smallest cache size, a multiple of granularity, whose PC plan costs at most target_cost, or the
+    given fraction of the cost without any cache. Binary search over the cache size, with every run on
+    sizes quantized to the granularity, which defaults to 1/1024 of full_cache_size. That takes about a
+    dozen runs with at most 1024 plans per node. Returns the FrontierPoint found and leaves its plan in
+    ex_tree, or None if the target cannot be reached.
+    PC's cost is not monotone in the cache size, so the search can stop above a size that reaches the target.
+    Sizes one step below the answer are checked as long as they reach it, but one further below may still."""
+    assert (target_cost is None) != (fraction is None)
+    full = full_cache_size(ex_tree)
+    granularity = granularity or max(full / 1024, 1)
+    points = {}
+
+    def point(steps):
+        # Runs do not share a memo, since the cost PC reports depends on which plans it reused
+        if steps not in points:
+            ex_tree.reset()
+            ex_tree.cache_size = steps * granularity
+            pc(ex_tree, granularity=granularity)
+            points[steps] = FrontierPoint(ex_tree.cache_size, ex_tree.total_cost, ex_tree.c_r)
+            if verbose:
+                print(points[steps])
+        return points[steps]
+
+    if target_cost is None:
+        target_cost = fraction * point(0).total_cost
+    lo, hi = -1, math.ceil(full / granularity)
+    if point(hi).total_cost > target_cost:
+        return None
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if point(mid).total_cost <= target_cost:
+            hi = mid
+        else:
+            lo = mid
+    while hi > 0 and point(hi - 1).total_cost <= target_cost:
+        hi -= 1
+    if ex_tree.cache_size != points[hi].cache_size:
+        points.pop(hi)
+        point(hi)
+    return points[hi]
+
+
+def cache_sweep(algorithm, ex_tree, budgets, verbose=False, plan_cache=None, granularity=None):
+    """Run algorithm for every budget, in the order given, and reset the tree after.
+    PC goes through pc_frontier, which shares its memo across the budgets and keeps their plans, the others
+    are run once per budget. Exact sizes seldom give two budgets the same sub-problem, so the sharing pays
+    off only with a granularity, which is passed on to pc_frontier.
+    With a plan_cache.PlanCache, the points of a sweep done before on the same inputs are looked up instead."""
+    if plan_cache is not None:
+        key = plan_cache.key(ex_tree, algorithm.__name__, budgets=list(budgets), granularity=granularity)
+        return plan_cache.cached(key, lambda: cache_sweep(algorithm, ex_tree, budgets, verbose,
+                                                          granularity=granularity))
+    if algorithm is pc:
+        return pc_frontier(ex_tree, budgets, verbose, granularity)
+    points = []
+    for budget in budgets:
+        ex_tree.cache_size = budget
+        algorithm(ex_tree, verbose=verbose)
+        points.append(FrontierPoint(budget, cost(ex_tree), getattr(ex_tree, 'c_r', None)))
+        ex_tree.reset()
+    return points
+
+
 def lfu(ex_tree, verbose=False):
-    ex_tree.get_node(ex_tree.root).data.recursive_cache = True
-    ex_tree.total_cost = 0
-    freq = ddict(int)
-    depth = {}
-    cache = {}
-    for path in paths_to_leaves(ex_tree):
-        next_d = 0
-        for d, node in enumerate(path):
-            freq[node] += 1
-            depth[node] = d
-            if node in cache: next_d = d + 1
-        while next_d < len(path):
-            ex_tree.total_cost += node.data.r_cost
-            node = path[next_d]
-            next_d += 1
-            cache_nodes = list(cache)
-            cache_nodes.append(node)
-            cache[node] = node.data.c_size
-            cache_nodes.sort(key=lambda n: (freq[n], -depth[n]))
-            new_cache = {}
-            while cache_nodes and sum(new_cache.values()) + cache[cache_nodes[-1]] <= ex_tree.cache_size:
-                new_cache[cache_nodes[-1]] = cache[cache_nodes[-1]]
-                cache_nodes.pop()
-            cache = new_cache
+    """Run the LFU cache policy, see policies.LFU"""
+    return online(ex_tree, 'LFU', verbose)
+
+
+def lru(ex_tree, verbose=False):
+    """Run the LRU cache policy"""
+    return online(ex_tree, 'LRU', verbose)
+
+
+def greedy_dual(ex_tree, verbose=False):
+    """Run the GreedyDual-Size cache policy"""
+    return online(ex_tree, 'GDS', verbose)
+
+
+def belady(ex_tree, verbose=False):
+    """Run the offline Belady (MIN) cache policy"""
+    return online(ex_tree, 'BELADY', verbose)
+
+
+def _pc_cached_nodes(ex_tree):
+    """Nodes the current PC plan keeps in cache for at least one of their children"""
+    cached = set()
+    stack = [(ex_tree.get_node(ex_tree.root), plan_budget(ex_tree))]
+    while stack:
+        node, cache = stack.pop()
+        for child, p_in_c in node.data.recursive_cache[cache]:
+            if p_in_c:
+                cached.add(node)
+            if child is not node:
+                stack.append((child, plan_key(ex_tree, node, cache, p_in_c)))
+    return cached
+
+
+def _pc_live_intervals(ex_tree):
+    """Steps of the current PC plan every checkpoint is kept for, as [start, end) intervals per node.
+    A checkpoint is kept while the child it was made for is replayed, so the ones kept at any step
+    are those on the plan's current path and fit in the budget together."""
+    intervals = ddict(list)
+    root = ex_tree.get_node(ex_tree.root)
+    stack = [(root, plan_budget(ex_tree), iter(root.data.recursive_cache[plan_budget(ex_tree)]), None)]
+    step = 0
+    while stack:
+        node, cache, entries, start = stack[-1]
+        child, to_cache = next(entries, (None, None))
+        if child is None:
+            stack.pop()
+            if start is not None:
+                intervals[ex_tree.parent(node.identifier)].append((start, step))
+            continue
+        step += 1
+        if child is not node:
+            child_cache = plan_key(ex_tree, node, cache, to_cache)
+            stack.append((child, child_cache, iter(child.data.recursive_cache[child_cache]),
+                          step if to_cache else None))
+    return intervals, step
+
+
+def _place_tiers(ex_tree, tiers):
+    """Place every checkpoint of the current plan on a tier, as a map from identifiers to tiers.
+    Checkpoints that save the most time per byte over the slowest tier go first, each on the fastest
+    tier with room whenever it is kept. Returns the checkpoint that fit on no tier if any."""
+    intervals, steps = _pc_live_intervals(ex_tree)
+    dumps, restores = ddict(int), ddict(int)
+    for op, node in replay_ops(ex_tree):
+        if op == 'checkpoint':
+            dumps[node] += 1
+        elif op == 'restore':
+            restores[node] += 1
+
+    def io(node, tier):
+        if tier.cost_model is None:
+            return 0
+        # A checkpoint is restored right after its dump to keep running
+        return (dumps[node] * tier.cost_model.dump(ex_tree, node)
+                + (dumps[node] + restores[node]) * tier.cost_model.restore(ex_tree, node))
+
+    def saving(node):
+        return (max(io(node, tier) for tier in tiers) - min(io(node, tier) for tier in tiers)) \
+            / max(node.data.c_size, 1)
+
+    usage = [[0] * (steps + 1) for _ in tiers]
+    placement = {}
+    for node in sorted(intervals, key=saving, reverse=True):
+        size = plan_size(ex_tree, node)
+        fitting = [(io(node, tier), i) for i, tier in enumerate(tiers)
+                   if all(max(usage[i][start:end]) + size <= tier.capacity for start, end in intervals[node])]
+        if not fitting:
+            return None, node
+        _, i = min(fitting)
+        for start, end in intervals[node]:
+            for step in range(start, end):
+                usage[i][step] += size
+        placement[node.identifier] = tiers[i]
+    return placement, None
+
+
+def pc_tiers(ex_tree, tiers, verbose=False, rounds=4):
+    """Run PC for several checkpoint tiers, such as RAM and SSD, and place every checkpoint on one.
+    Every tier is planned on its own first, with its capacity and cost model. Then PC plans for the combined
+    capacity with every checkpoint dumped and restored under the cost model of its tier, starting on the
+    fastest one, and the hottest checkpoints are placed on the tiers where they restore fastest. That is
+    repeated for the new placement up to rounds times, and the budget shrinks by the size of a checkpoint
+    that fits on no tier. The plan that replays fastest is kept, so it is never worse than the best single
+    tier. ex_tree.cache_size is left at the budget the plan used, ex_tree.checkpoint_tiers holds the
+    placement and the replay_time of the plan is returned."""
+    assert tiers
+    assert not getattr(ex_tree, 'dedup', False), 'Tiers are placed by full checkpoint sizes'
+    cost_model = getattr(ex_tree, 'cost_model', None)
+    # PC only charges dumps and restores with a cost model, the tiers' ones replace it for placed checkpoints
+    ex_tree.cost_model = cost_model or IOCost()
+    best = None
+
+    def plan(budget, guess, place_on):
+        nonlocal best
+        ex_tree.reset()
+        ex_tree.cache_size = budget
+        ex_tree.checkpoint_tiers = guess
+        pc(ex_tree, verbose)
+        placement, failed = _place_tiers(ex_tree, place_on)
+        if placement is None:
+            return None, failed
+        ex_tree.checkpoint_tiers = placement
+        total_cost = replay_time(ex_tree)
+        if verbose:
+            print(f'{total_cost=} at {budget=} with',
+                  {tier.name: sum(1 for placed in placement.values() if placed is tier) for tier in place_on})
+        if best is None or total_cost < best[0]:
+            best = total_cost, budget, placement, export_plans(ex_tree)
+        return placement, None
+
+    # The replay starts by restoring the root's image, which stays under ex_tree.cost_model unless it is placed
+    nodes = [node for node in ex_tree.all_nodes_itr() if node.identifier != ex_tree.root]
+    for tier in tiers:
+        plan(tier.capacity, {node.identifier: tier for node in nodes}, [tier])
+
+    def fastest(node):
+        return min(tiers, key=lambda tier: 0 if tier.cost_model is None
+                   else tier.cost_model.dump(ex_tree, node) + tier.cost_model.restore(ex_tree, node))
+
+    guess = {node.identifier: fastest(node) for node in nodes}
+    budget = sum(tier.capacity for tier in tiers)
+    for _ in range(rounds if len(tiers) > 1 else 0):
+        placement, failed = plan(budget, guess, tiers)
+        if placement is None:
+            if verbose:
+                print(f'{failed} fits on no tier at {budget=}')
+            budget -= max(plan_size(ex_tree, failed), 1)
+        else:
+            guess = {**guess, **placement}
+
+    total_cost, budget, placement, plans = best
+    ex_tree.reset()
+    ex_tree.cost_model = cost_model
+    ex_tree.cache_size = budget
+    import_plans(ex_tree, plans)
+    ex_tree.tiers = tiers
+    ex_tree.checkpoint_tiers = placement
+    ex_tree.total_cost = total_cost
+    ex_tree.c_r = checkpoints_restores(ex_tree)
+    return total_cost
+
+
+def dfs_incumbent(ex_tree):
+    """Best DFS solution among PRP and the nodes cached by PC's plan, as (cost, cached nodes).
+    Leaves the tree reset."""
+    index = ex_tree.path_index()
+    candidates = []
+    for algorithm in (prp_v1, prp_v2, pc):
+        ex_tree.reset()
+        algorithm(ex_tree)
+        cached = (_pc_cached_nodes(ex_tree) if algorithm is pc
+                  else {node for node in ex_tree.all_nodes_itr() if node.data.x_in_cache})
+        ex_tree.reset()
+        for node in cached:
+            index.add(node)
+        if index.usage(ex_tree.get_node(ex_tree.root)) <= ex_tree.cache_size:
+            for node in cached:
+                node.data.x_in_cache = True
+            candidates.append((dfs_cost(ex_tree) + dfs_io_cost(ex_tree), cached))
+        ex_tree.reset()
+    return min(candidates, key=lambda candidate: candidate[0])
+
+
+def optimal_bnb(ex_tree, verbose=False, node_limit=10 ** 6, time_limit=None):
+    """Find the optimal DFS solution by branch-and-bound over x_in_cache, without a MINLP solver.
+    The dfs_incumbent is the first upper bound, and caching every undecided node that still fits
+    on its own is the lower bound. Stops after node_limit branches or time_limit seconds with the
+    best solution found, ex_tree.bnb_optimal tells if it was proven. The bound needs the cost without
+    a cost model, since caching more nodes can add dumps and restores."""
+    assert getattr(ex_tree, 'cost_model', None) is None
+    index = ex_tree.path_index()
+    order = [node for node in ex_tree.all_nodes_itr() if not node.is_leaf()]
+    order.sort(key=lambda node: ex_tree.depth(node))
+    deadline = time_limit and time.monotonic() + time_limit
+    best_cost, best = dfs_incumbent(ex_tree)
+    branches, stopped = 0, False
+
+    def lower_bound(i):
+        relaxed = [node for node in order[i:] if index.fits(node)]
+        for node in relaxed:
+            node.data.x_in_cache = True
+        bound = dfs_cost(ex_tree)
+        for node in relaxed:
+            node.data.x_in_cache = False
+        return bound
+
+    def branch(i):
+        nonlocal best_cost, best, branches, stopped
+        if stopped or branches >= node_limit or (deadline and time.monotonic() > deadline):
+            stopped = True
+            return
+        branches += 1
+        bound = lower_bound(i)
+        if bound >= best_cost:
+            return
+        if i == len(order):
+            # Nothing is left undecided, so the bound is the cost
+            best_cost, best = bound, {node for node in order if node.data.x_in_cache}
+            if verbose:
+                print(f'{best_cost=} after {branches} branches')
+            return
+        node = order[i]
+        if index.fits(node):
+            node.data.x_in_cache = True
+            index.add(node)
+            yield i + 1,
+            index.remove(node)
+            node.data.x_in_cache = False
+        yield i + 1,
+
+    run_recursion(branch, 0)
+    ex_tree.bnb_optimal = not stopped
+    ex_tree.bnb_branches = branches
+    for node in best:
+        node.data.x_in_cache = True
+        index.add(node)
+    if verbose:
+        print(f'{best_cost=} {branches=} optimal={ex_tree.bnb_optimal}')
+        ex_tree.show(data_property='x_in_cache')
+
+
+def _local_moves(ex_tree, node):
+    """Nodes a checkpoint at node can move to, its parent, children and siblings"""
+    parent = ex_tree.parent(node.identifier)
+    moves = ex_tree.children(node.identifier)
+    if parent is not None:
+        moves = moves + [parent] + ex_tree.children(parent.identifier)
+    return [move for move in moves if move is not node and not move.is_leaf()]
+
+
+def local_search(ex_tree, verbose=False, time_limit=60, seed=None):
+    """Improve PC's plan by local search over DFS solutions until time_limit seconds have passed.
+    Starts from the nodes PC's plan keeps in cache, or the dfs_incumbent if they do not fit as a DFS solution.
+    Caches every node that fits and saves cost, then moves checkpoints to a neighbouring node when that
+    saves more than it loses, and drops a few random checkpoints from the best solution once stuck.
+    Costs are updated along the ancestor chain of every move. The best solution is replayed with
+    policies.online like the other DFS planners, and kept only if that is faster than PC's plan."""
+    pc(ex_tree)
+    pc_cost, pc_plans, pc_c_r = replay_time(ex_tree), export_plans(ex_tree), ex_tree.c_r
+    index = ex_tree.path_index()
+    rng = random.Random(seed)
+    deadline = time.monotonic() + time_limit
+    inner = [node for node in ex_tree.all_nodes_itr() if not node.is_leaf()]
+    best = _pc_cached_nodes(ex_tree)
+    ex_tree.reset()
+    for node in best:
+        index.add(node)
+    if index.usage(ex_tree.get_node(ex_tree.root)) > ex_tree.cache_size:
+        _, best = dfs_incumbent(ex_tree)
+    moves = 0
+
+    def apply(cached):
+        ex_tree.reset()
+        for node in cached:
+            node.data.x_in_cache = True
+            index.add(node)
+        return dfs_cost(ex_tree) + dfs_io_cost(ex_tree)
+
+    def cache(node):
+        nonlocal current_cost
+        current_cost -= dfs_gain(ex_tree, node)
+        dfs_cache(ex_tree, node)
+        index.add(node)
+
+    def evict(node):
+        nonlocal current_cost
+        current_cost += dfs_gain(ex_tree, node)
+        dfs_uncache(ex_tree, node)
+        index.remove(node)
+
+    best_cost = current_cost = apply(best)
+    while time.monotonic() < deadline:
+        improved = True
+        while improved and time.monotonic() < deadline:
+            improved = False
+            rng.shuffle(inner)
+            for node in inner:
+                if not node.data.x_in_cache and dfs_gain(ex_tree, node) > 0 and index.fits(node):
+                    cache(node)
+                    moves += 1
+            for node in [node for node in inner if node.data.x_in_cache]:
+                if time.monotonic() > deadline:
+                    break
+                loss = dfs_gain(ex_tree, node)
+                evict(node)
+                gain, target = max(((dfs_gain(ex_tree, move), move) for move in _local_moves(ex_tree, node)
+                                    if not move.data.x_in_cache and index.fits(move)),
+                                   key=lambda saving: saving[0], default=(0, None))
+                if target is not None and gain > loss:
+                    cache(target)
+                    moves += 1
+                    improved = True
+                else:
+                    cache(node)
+        if current_cost < best_cost:
+            best_cost, best = current_cost, {node for node in inner if node.data.x_in_cache}
+            if verbose:
+                print(f'{best_cost=} after {moves} moves')
+        kick = rng.sample(sorted(best, key=lambda node: node.identifier), min(len(best), rng.randint(1, 3)))
+        current_cost = apply(best)
+        for node in kick:
+            evict(node)
+
+    ex_tree.local_search_moves = moves
+    apply(best)
+    online(ex_tree, 'DFS')
+    if replay_time(ex_tree) >= pc_cost:
+        ex_tree.reset()
+        import_plans(ex_tree, pc_plans)
+        ex_tree.total_cost, ex_tree.c_r = pc_cost, pc_c_r
+    if verbose:
+        print(f'{ex_tree.total_cost=} {moves=}')
+        ex_tree.show(data_property='x_in_cache')
+    return ex_tree.total_cost
+
+
+def _smith_order(ex_tree, weights):
+    """Order the children in the current PC plan to minimize the weighted finish time of the leaves.
+    Children that keep their node in cache are replayed first and the rest after, as PC planned them, so only
+    the order within each group changes and the cost stays the same. Within a group, children go by Smith's
+    rule of increasing time per weight, with the restore or redo of their node before each of them."""
+    with_io = getattr(ex_tree, 'cost_model', None) is not None
+    root = ex_tree.get_node(ex_tree.root)
+    walk = []
+    stack = [(root, plan_budget(ex_tree), restore_cost(ex_tree, root) if with_io else 0)]
+    while stack:
+        node, cache, parent_cost = stack.pop()
+        walk.append((node, cache, parent_cost))
+        for child, cached in node.data.recursive_cache[cache][1:]:
+            if child is not node:
+                stack.append((child, plan_key(ex_tree, node, cache, cached),
+                              restore_cost(ex_tree, node) if cached else node.data.r_cost + parent_cost))
+
+    # time and weight of every sub-tree in the plan, children come after their parent in the walk
+    times, weights_below = {}, {}
+    for node, cache, parent_cost in reversed(walk):
+        plan = node.data.recursive_cache[cache]
+        children = [(child, cached) for child, cached in plan[1:] if child is not node]
+        if not children:
+            times[node] = node.data.r_cost
+            weights_below[node] = weights.get(node, 0) if weights is not None else 1
+            continue
+        redo = node.data.r_cost + parent_cost
+        restore = restore_cost(ex_tree, node)
+        times[node] = (node.data.r_cost + sum(times[child] for child, _ in children)
+                       + sum(child is node for child, _ in plan[1:]) * redo
+                       + plan_io_cost(plan, dump_cost(ex_tree, node), restore))
+        weights_below[node] = sum(weights_below[child] for child, _ in children)
+
+        def smith(overhead):
+            return lambda child: ((times[child] + overhead) / weights_below[child] if weights_below[child]
+                                  else math.inf)
+
+        kept = sorted((child for child, cached in children if cached), key=smith(restore))
+        rest = sorted((child for child, cached in children if not cached), key=smith(redo))
+        ordered = [plan[0]] + [(child, True) for child in kept]
+        for i, child in enumerate(rest):
+            if i:
+                # Every child after the first without node in cache redoes node
+                ordered.append((node, False))
+            ordered.append((child, False))
+        plan[:] = ordered
+
+
+def priority_order(ex_tree, weights=None, verbose=False):
+    """Replay PC's plan with the children of every node ordered to minimize the weighted finish time of the leaves.
+    weights maps leaves to their priority, where leaves left out have none, and every leaf has the same
+    priority without weights. A single leaf with a weight gets to that version early. PC's checkpoints are
+    kept, so the cost is the same as PC's, and the finish time of every leaf is kept in ex_tree.leaf_finish."""
+    pc(ex_tree)
+    _smith_order(ex_tree, weights)
+    ex_tree.leaf_finish = leaf_finish(ex_tree)
+    ex_tree.weighted_finish = sum((weights.get(leaf, 0) if weights is not None else 1) * finish
+                                  for leaf, finish in ex_tree.leaf_finish.items())
+    if verbose:
+        print(f'{ex_tree.total_cost=} {ex_tree.weighted_finish=}')
+    return ex_tree.total_cost
@@ -0,0 +1,103 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: Contract the single child chains of a tree before planning, and expand the plan back after.
+# Usage: For the planners to skip the nodes that are never worth caching on their own.
+
+import ExecutionTree as exT
+from util import post_order, replay_ops, dfs_cost, dump_cost, restore_cost
+
+
+def _dominated(ex_tree, node, paths):
+    """Check if caching node is never better than caching its only child.
+    That holds when the child is no larger and no slower to dump or restore, or node does not fit at all,
+    since both are on the same paths and the child saves more, and when a single path is left below node."""
+    children = ex_tree.children(node.identifier)
+    if node.identifier == ex_tree.root or len(children) != 1:
+        return False
+    child, = children
+    # A cost model need not grow with the size, so the I/O of both is compared as well
+    cheaper = (node.data.c_size >= child.data.c_size and dump_cost(ex_tree, node) >= dump_cost(ex_tree, child)
+               and restore_cost(ex_tree, node) >= restore_cost(ex_tree, child))
+    return node.data.c_size > ex_tree.cache_size or cheaper or paths[child.identifier] == 1
+
+
+def coarsen(ex_tree):
+    """Tree with every node merged into its only child while caching it is dominated, as (tree, members).
+    A merged node has the summed r_cost and the c_size of the deepest node, whose identifier it keeps,
+    and members maps it to the original nodes from the top. Exact for the DFS cost.
+    Its unique size is summed over the chain too, which bounds the bytes it does not share with its parent.
+    It keeps the cost model. A merged node is dumped and restored with the cost model of its deepest node."""
+    paths = {}
+    for node in post_order(ex_tree):
+        children = ex_tree.children(node.identifier)
+        paths[node.identifier] = sum(paths[child.identifier] for child in children) if children else 1
+
+    coarse = exT.ExecutionTree()
+    coarse.cache_size = ex_tree.cache_size
+    coarse.dedup = getattr(ex_tree, 'dedup', False)
+    coarse.cost_model = getattr(ex_tree, 'cost_model', None)
+    unique_sizes = getattr(ex_tree, 'unique_sizes', None) or {}
+    coarse.unique_sizes = {}
+    members = {}
+    stack = [(ex_tree.get_node(ex_tree.root), None)]
+    while stack:
+        node, parent = stack.pop()
+        chain = [node]
+        while _dominated(ex_tree, chain[-1], paths):
+            chain.append(ex_tree.children(chain[-1].identifier)[0])
+        tail = chain[-1]
+        coarse.create_node(tail.tag, tail.identifier, parent=parent,
+                           data=exT.NodeData(sum(member.data.r_cost for member in chain), tail.data.c_size))
+        members[tail.identifier] = chain
+        coarse.unique_sizes[tail.identifier] = sum(unique_sizes.get(member.identifier, member.data.c_size)
+                                                   for member in chain)
+        stack.extend((child, tail.identifier) for child in reversed(ex_tree.children(tail.identifier)))
+    return coarse, members
+
+
+def expand(ex_tree, coarse, members):
+    """Carry the solution planned on the coarse tree back to ex_tree.
+    A cached merged node caches its deepest node, and a replay plan is expanded into online_ops
+    that run every merged node in order."""
+    ex_tree.reset()
+    for node in coarse.all_nodes_itr():
+        if node.data.x_in_cache:
+            members[node.identifier][-1].data.x_in_cache = True
+    if not coarse.get_node(coarse.root).data.recursive_cache:
+        return dfs_cost(ex_tree)
+
+    ops = []
+    for op, node in replay_ops(coarse):
+        if op == 'run':
+            ops.extend(('run', member) for member in members[node.identifier])
+        else:
+            ops.append((op, members[node.identifier][-1]))
+    ex_tree.online_ops = ops
+    ex_tree.get_node(ex_tree.root).data.recursive_cache = True
+    ex_tree.total_cost = coarse.total_cost
+    ex_tree.c_r = coarse.c_r
+    return ex_tree.total_cost
+
+
+def coarsened(algorithm):
+    """Planner that runs algorithm on the coarse tree and expands its solution"""
+    def planner(ex_tree, *args, **kwargs):
+        coarse, members = coarsen(ex_tree)
+        algorithm(coarse, *args, **kwargs)
+        return expand(ex_tree, coarse, members)
+    return planner
@@ -22,6 +22,7 @@ from collections import defaultdict
 import matplotlib.pyplot as plt
 
 from util import create_registerer, cost
+from algorithms import cache_sweep
 import ExecutionTree as exT
 
 
@@ -53,14 +54,21 @@ def experiment(algorithms, x_param, *args, title=None, **kwargs):
         print(title)
     x_range = []
     y_ranges = defaultdict(list)
-    for x, ex_tree in get_trees(x_param, *args, **kwargs):
-        x_range.append(x)
-        if title:
-            print(f'x = {x}')
+    if x_param == 'cache_size':
+        # All cache sizes share one tree, so each algorithm sweeps them in one go
+        for x, ex_tree in get_trees(x_param, *args, **kwargs):
+            x_range.append(x)
         for algorithm in algorithms:
-            algorithm(ex_tree)
-            y_ranges[algorithm].append(cost(ex_tree))
-            ex_tree.reset()
+            y_ranges[algorithm] = [point.total_cost for point in cache_sweep(algorithm, ex_tree, x_range)]
+    else:
+        for x, ex_tree in get_trees(x_param, *args, **kwargs):
+            x_range.append(x)
+            if title:
+                print(f'x = {x}')
+            for algorithm in algorithms:
+                algorithm(ex_tree)
+                y_ranges[algorithm].append(cost(ex_tree))
+                ex_tree.reset()
 
     for algorithm in algorithms:
         plt.plot(list(range(len(x_range))), y_ranges[algorithm], label=algorithm.__name__)
@@ -96,8 +104,5 @@ def test(algorithms, verbose=False):
     print(f'Without Cache = {cost(ex_tree)}')
 
     for algorithm in algorithms:
-        for cache_sz in [i * 1024 ** 3 for i in range(1, 10)]:
-            ex_tree.cache_size = cache_sz
-            algorithm(ex_tree, verbose)
-            print(f'{algorithm.__name__} Cost (Cache:{cache_sz}) = {cost(ex_tree)}')
-            ex_tree.reset()
+        for point in cache_sweep(algorithm, ex_tree, [i * 1024 ** 3 for i in range(1, 10)], verbose):
+            print(f'{algorithm.__name__} Cost (Cache:{point.cache_size}) = {point.total_cost}')
@@ -0,0 +1,90 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: PC memo that keeps a bounded number of sub-problems in memory and forgets the rest.
+# Usage: For planning trees whose full PC memo does not fit in memory.
+
+import sys
+from collections import OrderedDict
+from collections.abc import Mapping
+
+
+class MemoView(Mapping):
+    """recursive_cache of a single node, backed by a BoundedMemo"""
+
+    def __init__(self, memo, node):
+        self.memo = memo
+        self.node = node
+
+    def __contains__(self, cache):
+        return (self.node, cache) in self.memo.entries
+
+    def __getitem__(self, cache):
+        return self.memo.entries[self.node, cache][0]
+
+    def __setitem__(self, cache, plan):
+        self.memo.store(self.node, cache, plan)
+
+    def __iter__(self):
+        return (cache for node, cache in self.memo.entries if node is self.node)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class BoundedMemo:
+    """Keeps at most limit PC sub-problems in memory, each as its plan and the costs PC answers later calls with,
+    evicting the least recently used one. A call to an evicted sub-problem plans it again, so the limit bounds
+    all of PC's memory at the price of time."""
+
+    def __init__(self, ex_tree, limit):
+        assert limit >= 1
+        self.limit = limit
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        for node in ex_tree.all_nodes_itr():
+            node.data.recursive_cache = MemoView(self, node)
+
+    def store(self, node, cache, plan):
+        """Keep the plan of a new sub-problem, its costs follow as soon as PC knows them"""
+        self.entries[node, cache] = [plan, None]
+        self.entries.move_to_end((node, cache))
+
+    def get(self, key):
+        """Costs of a sub-problem like the hit_costs of algorithms._pc_run, None if it is not in memory"""
+        entry = self.entries.get(key)
+        if entry is None or entry[1] is None:
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def __setitem__(self, key, known):
+        self.entries[key][1] = known
+        self.misses += 1
+        while len(self.entries) > self.limit:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def plan(self, node, cache):
+        """Plan of a sub-problem, None if it was evicted"""
+        entry = self.entries.get((node, cache))
+        return entry and entry[0]
+
+    def __sizeof__(self):
+        return sys.getsizeof(self.entries) + sum(sys.getsizeof(entry) + sys.getsizeof(entry[0]) + sys.getsizeof(key)
+                                                 for key, entry in self.entries.items())
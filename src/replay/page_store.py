@@ -0,0 +1,98 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: Content addressed store for the memory pages of CRIU images, shared by all checkpoints.
+# Usage: For Alice to measure the pages a checkpoint shares with its parent, and for Bob to keep them once.
+
+import os
+import glob
+import shutil
+import hashlib
+from collections import Counter
+
+PAGE_SIZE = 4096
+PAGE_FILES = 'pages-*.img'
+MANIFEST = '.digests'
+CHUNKS = 'chunks'
+
+
+def _pages(path):
+    with open(path, 'rb') as image:
+        yield from iter(lambda: image.read(PAGE_SIZE), b'')
+
+
+def image_pages(directory):
+    """Digests of the memory pages of the CRIU image in directory, with their counts"""
+    return Counter(hashlib.sha1(page).digest()
+                   for path in glob.glob(os.path.join(directory, PAGE_FILES)) for page in _pages(path))
+
+
+def shared_bytes(pages, other):
+    """Bytes of the pages that are also in other, both from image_pages"""
+    return sum((pages & other).values()) * PAGE_SIZE if other else 0
+
+
+def store_image(directory, store):
+    """Replace the page files of the CRIU image in directory by digests of the pages, keeping every page
+    once in store. The image links the pages it uses, so a page is freed with the last image using it."""
+    chunks = os.path.join(directory, CHUNKS)
+    os.makedirs(store, exist_ok=True)
+    os.makedirs(chunks, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, PAGE_FILES)):
+        digests = []
+        for page in _pages(path):
+            digest = hashlib.sha1(page).hexdigest()
+            stored = os.path.join(store, digest)
+            if not os.path.exists(stored):
+                with open(stored, 'wb') as chunk:
+                    chunk.write(page)
+            linked = os.path.join(chunks, digest)
+            if not os.path.exists(linked):
+                os.link(stored, linked)
+            digests.append(digest)
+        with open(path + MANIFEST, 'w') as manifest:
+            manifest.write('\n'.join(digests))
+        os.remove(path)
+
+
+def load_image(directory):
+    """Write back the page files of an image from store_image, for CRIU to restore"""
+    for path in glob.glob(os.path.join(directory, PAGE_FILES + MANIFEST)):
+        with open(path) as manifest, open(path[:-len(MANIFEST)], 'wb') as image:
+            for digest in manifest.read().split():
+                with open(os.path.join(directory, CHUNKS, digest), 'rb') as chunk:
+                    image.write(chunk.read())
+
+
+def unload_image(directory):
+    """Remove the page files written back by load_image once CRIU restored them"""
+    for path in glob.glob(os.path.join(directory, PAGE_FILES + MANIFEST)):
+        try:
+            os.remove(path[:-len(MANIFEST)])
+        except FileNotFoundError:
+            pass
+
+
+def delete_image(directory, store):
+    """Delete an image from store_image, along with the pages in store no other image uses"""
+    chunks = os.path.join(directory, CHUNKS)
+    digests = os.listdir(chunks) if os.path.isdir(chunks) else []
+    shutil.rmtree(directory, ignore_errors=True)
+    for digest in digests:
+        stored = os.path.join(store, digest)
+        if os.path.exists(stored) and os.stat(stored).st_nlink == 1:
+            os.remove(stored)
@@ -0,0 +1,106 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: Index over the root-to-leaf paths of an execution tree without materializing them.
+# Usage: For the planners to check path cache budgets in O(log n) instead of scanning every path.
+
+
+class PathIndex:
+    """Leaves in DFS order, where the leaves below every node form a contiguous interval.
+    Caching a node adds its c_size to the path of every leaf in its interval, so a segment tree
+    with range-add and range-max over the leaves tracks the cache used along every path."""
+
+    def __init__(self, ex_tree):
+        self.ex_tree = ex_tree
+        self.leaves = []
+        self.interval = {}
+
+        stack = [(ex_tree.get_node(ex_tree.root), False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                self.interval[node.identifier] = (self.interval[node.identifier], len(self.leaves))
+                continue
+            self.interval[node.identifier] = len(self.leaves)
+            children = ex_tree.children(node.identifier)
+            if not children:
+                self.leaves.append(node)
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+
+        self.reset()
+
+    def reset(self):
+        """Forget all cached nodes"""
+        self._max = [0] * (4 * max(1, len(self.leaves)))
+        self._add = [0] * (4 * max(1, len(self.leaves)))
+
+    def _update(self, i, lo, hi, q_lo, q_hi, value):
+        if q_hi <= lo or hi <= q_lo:
+            return
+        if q_lo <= lo and hi <= q_hi:
+            self._max[i] += value
+            self._add[i] += value
+            return
+        mid = (lo + hi) // 2
+        self._update(2 * i, lo, mid, q_lo, q_hi, value)
+        self._update(2 * i + 1, mid, hi, q_lo, q_hi, value)
+        self._max[i] = self._add[i] + max(self._max[2 * i], self._max[2 * i + 1])
+
+    def _query(self, i, lo, hi, q_lo, q_hi):
+        if q_hi <= lo or hi <= q_lo:
+            return float('-inf')
+        if q_lo <= lo and hi <= q_hi:
+            return self._max[i]
+        mid = (lo + hi) // 2
+        return self._add[i] + max(self._query(2 * i, lo, mid, q_lo, q_hi),
+                                  self._query(2 * i + 1, mid, hi, q_lo, q_hi))
+
+    def usage(self, node):
+        """Maximum cache used along any root-to-leaf path through node"""
+        return self._query(1, 0, len(self.leaves), *self.interval[node.identifier])
+
+    def fits(self, node, size=None):
+        """Check if caching node keeps every path through it within the cache size"""
+        if size is None:
+            size = node.data.c_size
+        return self.usage(node) + size <= self.ex_tree.cache_size
+
+    def add(self, node, size=None):
+        """Account for node being cached on every path through it"""
+        if size is None:
+            size = node.data.c_size
+        self._update(1, 0, len(self.leaves), *self.interval[node.identifier], size)
+
+    def remove(self, node, size=None):
+        """Account for node being evicted from every path through it"""
+        if size is None:
+            size = node.data.c_size
+        self._update(1, 0, len(self.leaves), *self.interval[node.identifier], -size)
+
+    def path(self, node):
+        """Nodes from the root down to node"""
+        path = [node]
+        while (parent := self.ex_tree.parent(path[-1].identifier)) is not None:
+            path.append(parent)
+        path.reverse()
+        return path
+
+    def paths(self):
+        """Root-to-leaf paths in DFS order, built one at a time"""
+        for leaf in self.leaves:
+            yield self.path(leaf)
@@ -0,0 +1,134 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: On-disk cache of planning results, keyed by a digest of the tree and the planning inputs.
+# Usage: For replay-order.py and the plots to look plans up instead of planning the same inputs again.
+
+import os
+import hashlib
+import functools
+import tempfile
+import pickle as pkl
+
+PLAN_CACHE_DIRECTORY = os.environ.get('CHEX_PLAN_CACHE',
+                                      os.path.join(os.path.expanduser('~'), '.cache', 'chex', 'plans'))
+PLAN_CACHE_SIZE = 1024 ** 3
+
+# Tree attributes besides the nodes that change what a planner does, or that the plan keeps
+PLAN_INPUTS = ('cost_model', 'dedup', 'unique_sizes')
+
+# Modules next to this one whose code makes the plans or the stored results, so a change to any plans again
+PLANNER_MODULES = ('algorithms', 'coarsen', 'ExecutionTree', 'memo', 'path_index', 'plan_cache', 'policies',
+                   'portfolio', 'solver_algorithms', 'util')
+
+
+def _stable(value):
+    """Representation of value that is the same across runs, for objects like cost models too"""
+    if isinstance(value, dict):
+        return repr(sorted((repr(key), _stable(item)) for key, item in value.items()))
+    if hasattr(value, '__dict__'):
+        return f'{type(value).__name__}{_stable(vars(value))}'
+    return repr(value)
+
+
+def tree_digest(ex_tree):
+    """Digest of the structure, child order, costs and sizes of ex_tree and of its PLAN_INPUTS"""
+    digest = hashlib.sha256()
+    stack = [ex_tree.get_node(ex_tree.root)]
+    while stack:
+        node = stack.pop()
+        parent = ex_tree.parent(node.identifier)
+        digest.update(repr((node.identifier, parent and parent.identifier,
+                            node.data.r_cost, node.data.c_size)).encode())
+        stack.extend(reversed(ex_tree.children(node.identifier)))
+    for name in PLAN_INPUTS:
+        digest.update(f'{name}={_stable(getattr(ex_tree, name, None))}'.encode())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def planner_digest():
+    """Digest of the source of PLANNER_MODULES"""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in PLANNER_MODULES:
+        with open(os.path.join(directory, f'{name}.py'), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+class PlanCache:
+    """Directory of pickled planning results taking at most max_bytes, evicting the least recently used.
+    A result is looked up by the key of its tree, algorithm and parameters, so any change to those plans again,
+    and so does any change to the planners' code."""
+
+    def __init__(self, directory=PLAN_CACHE_DIRECTORY, max_bytes=PLAN_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(ex_tree, algorithm, **params):
+        """Key of planning ex_tree with algorithm, a name, and params like the cache size"""
+        return hashlib.sha256(f'{planner_digest()}|{tree_digest(ex_tree)}|{algorithm}|{_stable(params)}'
+                              .encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key):
+        """Result stored for key, marked as recently used, or None"""
+        try:
+            with open(self.path(key), 'rb') as result_file:
+                result = pkl.load(result_file)
+        except (FileNotFoundError, EOFError, pkl.UnpicklingError):
+            return None
+        # Another run may have evicted it since, which leaves the loaded result as good
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """Store result for key, then evict the least recently used results over max_bytes"""
+        # Written to a temporary file first, so concurrent runs never read half a result
+        with tempfile.NamedTemporaryFile('wb', dir=self.directory, delete=False) as result_file:
+            pkl.dump(result, result_file)
+        os.replace(result_file.name, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        used = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if used <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            used -= size
+
+    def cached(self, key, compute):
+        """Result for key, computed by compute and stored if it is not in the cache"""
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
@@ -32,6 +32,7 @@ import ExecutionTree as exT
 from util import *
 from algorithms import *
 from solver_algorithms import *
+from plan_cache import PlanCache
 
 
 # plt.rc('font', size=14, weight='bold')
@@ -48,6 +49,8 @@ VERBOSE_SHOW_PLOT = False
 ALGORITHM_VERBOSE = False
 VERBOSE_PRINT_INFO = True
 EXP_COUNT = 10
+# Sweeps of the real trees are looked up here when they were done before, the synthetic trees are new every run
+PLAN_CACHE = PlanCache()
 
 ALGOS = {prp_v1: 'PRP-v1',
          prp_v2: 'PRP-v2',
@@ -86,13 +89,11 @@ def plot_real(verbose=False):
             print_info(ex_tree, trees[t])
         for algorithm, l in zip(ALGOS, LINSHAPES):
             data[t][algorithm] = [(0, cost(ex_tree) / 10**p[1])]
-            for cache_sz in tmems:
-                ex_tree.cache_size = cache_sz
-                algorithm(ex_tree, verbose=verbose and ALGORITHM_VERBOSE)
+            for point in cache_sweep(algorithm, ex_tree, tmems, verbose=verbose and ALGORITHM_VERBOSE,
+                                     plan_cache=PLAN_CACHE):
                 if verbose:
-                    print(f'{t}-{ALGOS[algorithm]} Cost (Cache:{cache_sz}) = {cost(ex_tree)}')
-                data[t][algorithm].append((cache_sz / 1024**p[0], cost(ex_tree) / 10**p[1]))
-                ex_tree.reset()
+                    print(f'{t}-{ALGOS[algorithm]} Cost (Cache:{point.cache_size}) = {point.total_cost}')
+                data[t][algorithm].append((point.cache_size / 1024**p[0], point.total_cost / 10**p[1]))
             plt.plot(*zip(*data[t][algorithm]), l, label=ALGOS[algorithm])
         # plt.xlabel(LABEL_CACHE_SIZE(p[0]))
         plt.xlabel(f'Cache Size (X = {tmems[0] / 1024**p[0]:.2f} {LABEL_CACHE_SIZE_MAP[p[0]]})')
@@ -162,13 +163,10 @@ def plot_synthetic(verbose=False):
                 print_info(ex_tree, tname)
             for algorithm in ALGOS:
                 data[t][algorithm][0].append(cost(ex_tree))
-                for cache_sz in tmems:
-                    ex_tree.cache_size = cache_sz
-                    algorithm(ex_tree, verbose=verbose and ALGORITHM_VERBOSE)
+                for point in cache_sweep(algorithm, ex_tree, tmems, verbose=verbose and ALGORITHM_VERBOSE):
                     if verbose:
-                        print(f'{tname}-{ALGOS[algorithm]} Cost (Cache:{cache_sz}) = {cost(ex_tree)}')
-                    data[t][algorithm][cache_sz / 1024**3].append(cost(ex_tree))
-                    ex_tree.reset()
+                        print(f'{tname}-{ALGOS[algorithm]} Cost (Cache:{point.cache_size}) = {point.total_cost}')
+                    data[t][algorithm][point.cache_size / 1024**3].append(point.total_cost)
 
         for algorithm, l in zip(data[t], LINSHAPES):
             x, y, dy = [], [], []
@@ -211,13 +209,10 @@ def plot_cr(verbose=False):
             ex_tree = exT.create_tree('SIZE', t, 4, 6, an_node_factory)
             if verbose and VERBOSE_PRINT_INFO:
                 print_info(ex_tree, f'TS: {t}')
-            for cache_sz in t_mems:
-                ex_tree.cache_size = cache_sz
-                pc(ex_tree, verbose=verbose and ALGORITHM_VERBOSE)
+            for point in cache_sweep(pc, ex_tree, t_mems, verbose=verbose and ALGORITHM_VERBOSE):
                 if verbose:
-                    print(f'Cache:{cache_sz} {t} = {ex_tree.c_r}')
-                data[t][cache_sz / 1024**2].append(ex_tree.c_r)
-                ex_tree.reset()
+                    print(f'Cache:{point.cache_size} {t} = {point.c_r}')
+                data[t][point.cache_size / 1024**2].append(point.c_r)
         x, y, dy = [], [], []
         for c in data[t]:
             x.append(c)
@@ -311,18 +306,9 @@ def plot_versions(verbose=False):
     tmax = min(max(max(c for _, c in data[m][e]) for e in data[m]) for m in data)
     x = np.linspace(0, tmax, 1000)
     for mem, l in zip(mems, LINSHAPES):
-        ys = [[] for _ in x]
-        for e in data[mem]:
-            i, pl = 0, 0
-            for le, c in data[mem][e]:
-                while i < len(x) and x[i] < c:
-                    ys[i].append(pl)
-                    i += 1
-                pl = le
-            while i < len(x):
-                ys[i].append(pl)
-                i += 1
-        ys = np.array(ys)
+        # Every leaf count is a new random tree, so a count fits only if it and all smaller ones cost at most x
+        ys = np.array([np.concatenate(([0], les))[np.searchsorted(np.maximum.accumulate(costs), x, side='right')]
+                       for les, costs in (np.array(data[mem][e]).T for e in data[mem])]).T
         y = np.mean(ys, axis=1)
         dy = np.std(ys, axis=1)
         # if PLOT_ERROR_BARS:
@@ -497,13 +483,11 @@ def plot_sciunit(verbose=False):
         print_info(ex_tree, 'Sciunit')
     for algorithm, l in zip(ALGOS, LINSHAPES):
         data[algorithm] = [(0, cost(ex_tree) / 10 ** p[1])]
-        for cache_sz in tmems:
-            ex_tree.cache_size = cache_sz
-            algorithm(ex_tree, verbose=verbose and ALGORITHM_VERBOSE)
+        for point in cache_sweep(algorithm, ex_tree, tmems, verbose=verbose and ALGORITHM_VERBOSE,
+                                 plan_cache=PLAN_CACHE):
             if verbose:
-                print(f'{ALGOS[algorithm]} Cost (Cache:{cache_sz}) = {cost(ex_tree)}')
-            data[algorithm].append((cache_sz / 1024 ** p[0], cost(ex_tree) / 10 ** p[1]))
-            ex_tree.reset()
+                print(f'{ALGOS[algorithm]} Cost (Cache:{point.cache_size}) = {point.total_cost}')
+            data[algorithm].append((point.cache_size / 1024 ** p[0], point.total_cost / 10 ** p[1]))
         plt.plot(*zip(*data[algorithm]), l, label=ALGOS[algorithm])
     # plt.xlabel(LABEL_CACHE_SIZE(p[0]))
     plt.xlabel(f'Cache Size (X = {tmems[0] / 1024 ** p[0]:.2f} {LABEL_CACHE_SIZE_MAP[p[0]]})')
@@ -0,0 +1,247 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: Online cache policies that replay the tree one root-to-leaf path at a time.
+# Usage: For Bob to generate replay sequences with cheap cache policies instead of a planner.
+
+import abc
+import math
+import heapq
+from itertools import count
+from collections import defaultdict as ddict
+
+from util import create_registerer, dump_cost, restore_cost
+
+
+create_policy, register_policy = create_registerer()
+
+
+class HeapPolicy(abc.ABC):
+    """Cache of checkpoints that evicts the lowest priority ones until it fits.
+    Priorities are kept in a heap, where an entry is stale once its node is pushed again or evicted.
+    With drop_exhausted, a node with no leaf left to replay below it is not kept."""
+
+    drop_exhausted = True
+
+    def __init__(self, ex_tree):
+        self.ex_tree = ex_tree
+        self.index = ex_tree.path_index()
+        self.leaf = -1
+        self.cache = {}
+        self.used = 0
+        self.heap = []
+        self.order = count()
+        self.path_costs = {}
+
+    @abc.abstractmethod
+    def priority(self, node):
+        """Key of node in the heap, the lowest one is evicted first"""
+
+    def push(self, node):
+        """Add node to the cache, or update its priority if it is already cached"""
+        key = self.priority(node), next(self.order)
+        if node not in self.cache:
+            self.used += node.data.c_size
+        self.cache[node] = key
+        heapq.heappush(self.heap, (key, node))
+
+    def evict(self, node):
+        del self.cache[node]
+        if math.isinf(node.data.c_size):
+            self.used = sum(cached.data.c_size for cached in self.cache)
+        else:
+            self.used -= node.data.c_size
+
+    def access(self, path):
+        """Start replaying the path to a new leaf, returning the nodes evicted for it"""
+        return []
+
+    def restore(self, node):
+        """Node's checkpoint is restored to replay the current path"""
+
+    def worth(self, node):
+        """Check if dumping node can pay off, which needs a leaf below it that is still to be replayed, and
+        under the cost model those leaves to save more by restoring it than the dump takes.
+        Without a cost model, a node with no leaf left is only refused with drop_exhausted."""
+        left = self.index.interval[node.identifier][1] - self.leaf - 1
+        if getattr(self.ex_tree, 'cost_model', None) is None:
+            return left > 0 or not self.drop_exhausted
+        parent = self.ex_tree.parent(node.identifier)
+        self.path_costs[node] = node.data.r_cost + self.path_costs.get(parent, 0)
+        root = self.ex_tree.get_node(self.ex_tree.root)
+        return left * (self.path_costs[node] - restore_cost(self.ex_tree, node)
+                       + restore_cost(self.ex_tree, root)) > dump_cost(self.ex_tree, node)
+
+    def admit(self, node):
+        """Offer the checkpoint of a computed node to the cache, returning the evicted nodes.
+        The node itself is among them if it was not kept. The root is never kept, since every path
+        that does not restore a checkpoint starts by restoring the root's image and running it."""
+        if node.identifier == self.ex_tree.root or not self.worth(node):
+            return [node]
+        self.push(node)
+        evicted = []
+        while self.used > self.ex_tree.cache_size:
+            key, victim = heapq.heappop(self.heap)
+            if self.cache.get(victim) == key:
+                self.evict(victim)
+                evicted.append(victim)
+        return evicted
+
+
+@register_policy('LFU')
+class LFU(HeapPolicy):
+    """Keep the nodes on the most paths so far, then the shallowest ones.
+    Evicting from the bottom until the cache fits keeps the longest prefix of that order that fits.
+    Nodes with no leaf left below them are kept as well, as lfu always did."""
+
+    drop_exhausted = False
+
+    def __init__(self, ex_tree):
+        super().__init__(ex_tree)
+        self.freq = ddict(int)
+
+    def priority(self, node):
+        return self.freq[node], -self.ex_tree.depth(node)
+
+    def access(self, path):
+        for node in path:
+            self.freq[node] += 1
+            if node in self.cache:
+                self.push(node)
+        return []
+
+
+@register_policy('LRU')
+class LRU(HeapPolicy):
+    """Keep the most recently computed or restored nodes"""
+
+    def priority(self, node):
+        return 0
+
+    def restore(self, node):
+        self.push(node)
+
+
+@register_policy('GDS')
+class GreedyDualSize(HeapPolicy):
+    """GreedyDual-Size, where the cost of a node is the cost of computing it from the root.
+    Priorities are inflated by the priority of the last evicted node, so entries that are not used age."""
+
+    def __init__(self, ex_tree):
+        super().__init__(ex_tree)
+        self.inflation = 0
+        self.root_cost = {}
+
+    def priority(self, node):
+        # Ancestors are not always pushed before node, so the path up to a known one is filled in
+        path = []
+        while node is not None and node not in self.root_cost:
+            path.append(node)
+            node = self.ex_tree.parent(node.identifier)
+        for path_node in reversed(path):
+            self.root_cost[path_node] = path_node.data.r_cost + (self.root_cost[node] if node is not None else 0)
+            node = path_node
+        return self.inflation + self.root_cost[node] / max(node.data.c_size, 1)
+
+    def restore(self, node):
+        self.push(node)
+
+    def evict(self, node):
+        self.inflation = self.cache[node][0]
+        super().evict(node)
+
+
+@register_policy('BELADY')
+class Belady(HeapPolicy):
+    """Offline MIN policy. Leaves are replayed in DFS order, so a node is needed again exactly until the
+    last leaf below it is replayed. Nodes that are not needed again go first, then the shallowest ones."""
+
+    def __init__(self, ex_tree):
+        super().__init__(ex_tree)
+        self.path = []
+
+    def priority(self, node):
+        return self.index.interval[node.identifier][1] > self.leaf + 1, self.ex_tree.depth(node)
+
+    def access(self, path):
+        for node in self.path:
+            if node in self.cache:
+                self.push(node)
+        self.path = path
+        return []
+
+
+@register_policy('DFS')
+class StaticDFS(HeapPolicy):
+    """Keep exactly the nodes in x_in_cache, for as long as a leaf below them is left to replay.
+    Replays the DFS solution of PRP or the optimal planners, with the cost given by dfs_cost unless the root
+    is in x_in_cache, which is not kept like in every policy."""
+
+    def priority(self, node):
+        return 0
+
+    def access(self, path):
+        done = [node for node in self.cache if self.index.interval[node.identifier][1] <= self.leaf]
+        for node in done:
+            self.evict(node)
+        return done
+
+    def admit(self, node):
+        if not node.data.x_in_cache or node.is_leaf() or node.identifier == self.ex_tree.root:
+            return [node]
+        self.push(node)
+        assert self.used <= self.ex_tree.cache_size
+        return []
+
+
+def online(ex_tree, policy, verbose=False):
+    """Replay every root-to-leaf path in DFS order from its deepest checkpoint, with policy deciding
+    the checkpoints to keep. The replay is kept as ex_tree.online_ops in the form of util.replay_ops,
+    with ('evict', node) steps when a checkpoint can be deleted. total_cost includes the dumps and
+    restores under ex_tree.cost_model."""
+    policy = create_policy(policy, ex_tree)
+    root = ex_tree.get_node(ex_tree.root)
+    root.data.recursive_cache = True
+    ex_tree.total_cost = 0
+    ex_tree.c_r = 0
+    ops = []
+    for policy.leaf, path in enumerate(ex_tree.path_index().paths()):
+        ops.extend(('evict', node) for node in policy.access(path) if node is not root)
+        start = max((d for d, node in enumerate(path) if node in policy.cache), default=None)
+        if start is None:
+            ops.append(('restore', root))
+            ex_tree.total_cost += restore_cost(ex_tree, root)
+            compute = path
+        else:
+            policy.restore(path[start])
+            ops.append(('restore', path[start]))
+            ex_tree.total_cost += restore_cost(ex_tree, path[start])
+            compute = path[start + 1:]
+        for node in compute:
+            ex_tree.total_cost += node.data.r_cost
+            if node is not root:
+                ops.append(('run', node))
+            evicted = policy.admit(node)
+            ops.extend(('evict', victim) for victim in evicted if victim is not node and victim is not root)
+            if node not in evicted and node is not root:
+                ops.append(('checkpoint', node))
+                ex_tree.total_cost += dump_cost(ex_tree, node)
+                ex_tree.c_r += 1
+    ex_tree.online_ops = ops
+    if verbose:
+        print(f'{ex_tree.total_cost=} {ex_tree.c_r=}')
+    return ex_tree.total_cost
@@ -0,0 +1,146 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: Registry of the planners that emit replay plans, and a portfolio that races them.
+# Usage: For Bob to replay with the best plan found within a fixed planning time.
+
+import os
+import math
+import json
+import time
+import tempfile
+import tracemalloc
+import pickle as pkl
+import multiprocessing as mp
+
+from util import create_registerer, cost, replay_time
+from algorithms import pc, prp_v1, prp_v2, lfu, lru, greedy_dual, belady, priority_order, local_search
+from policies import online
+from coarsen import coarsened
+
+
+plan_tree, register_planner = create_registerer()
+
+
+def dfs_planner(algorithm):
+    """Planner that replays the DFS solution of algorithm, keeping only the nodes it caches"""
+    def planner(ex_tree):
+        algorithm(ex_tree)
+        online(ex_tree, 'DFS')
+    return planner
+
+
+register_planner('pc')(pc)
+register_planner('pc-coarse')(coarsened(pc))
+register_planner('prpv1')(dfs_planner(prp_v1))
+register_planner('prpv2')(dfs_planner(prp_v2))
+register_planner('lfu')(lfu)
+register_planner('lru')(lru)
+register_planner('gds')(greedy_dual)
+register_planner('belady')(belady)
+register_planner('priority')(priority_order)
+register_planner('local-search')(local_search)
+
+
+def cached_plan(planner, ex_tree, plan_cache=None):
+    """Plan ex_tree with the registered planner and return the planned tree.
+    With a plan_cache.PlanCache, a tree planned before on the same inputs is looked up instead of ex_tree."""
+    if plan_cache is None:
+        plan_tree(planner, ex_tree)
+        return ex_tree
+
+    def planned():
+        plan_tree(planner, ex_tree)
+        return ex_tree
+    return plan_cache.cached(plan_cache.key(ex_tree, planner, cache_size=ex_tree.cache_size), planned)
+
+
+_portfolio_tree = None
+
+
+def _portfolio_init(ex_tree):
+    global _portfolio_tree
+    _portfolio_tree = ex_tree
+
+
+def _portfolio_plan(planner, directory, trace_memory, options):
+    """Plan the tree of this worker with one planner called with options, pickling the planned tree to directory"""
+    ex_tree = _portfolio_tree
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        plan_tree(planner, ex_tree, **options)
+    except Exception as e:
+        return dict(planner=planner, status='error', error=repr(e))
+    finally:
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        tracemalloc.stop()
+    plan_path = os.path.join(directory, f'{planner}.pkl')
+    with open(plan_path, 'wb') as plan_file:
+        pkl.dump(ex_tree, plan_file)
+    # Planners predict their cost their own way, so every plan is ranked by replaying its steps
+    planned_cost = cost(ex_tree)
+    return dict(planner=planner, status='done', cost=planned_cost,
+                replay_time=math.inf if math.isinf(planned_cost) else replay_time(ex_tree),
+                c_r=getattr(ex_tree, 'c_r', None), seconds=seconds, peak_memory=peak, plan_path=plan_path)
+
+
+def portfolio(ex_tree, deadline, planners=None, workers=None, trace_memory=True, record_path=None, verbose=False,
+              planner_options=None):
+    """Race planners on copies of ex_tree in a process pool for deadline seconds.
+    Planners still running at the deadline are terminated. Returns the planned tree of the finished
+    planner with the lowest finite util.replay_time, then fewest checkpoints, and the records of every
+    planner with its predicted cost, replay time, planning time and peak traced memory. The records are
+    also written to record_path as JSON if it is given.
+    planner_options maps a planner to the keyword arguments it is called with. By default local-search
+    gets half the deadline as its time limit, so it can finish before the deadline."""
+    planners = list(planners or plan_tree.map)
+    planner_options = {'local-search': dict(time_limit=deadline / 2), **(planner_options or {})}
+    end = time.monotonic() + deadline
+    best_tree = None
+    with tempfile.TemporaryDirectory() as directory:
+        pool = mp.Pool(workers or len(planners), _portfolio_init, (ex_tree,), maxtasksperchild=1)
+        try:
+            pending = {planner: pool.apply_async(_portfolio_plan, (planner, directory, trace_memory,
+                                                                   planner_options.get(planner, {})))
+                       for planner in planners}
+            records = []
+            for planner, result in pending.items():
+                result.wait(max(0, end - time.monotonic()))
+                records.append(result.get() if result.ready() else dict(planner=planner, status='timeout'))
+        finally:
+            pool.terminate()
+            pool.join()
+        finished = [record for record in records
+                    if record['status'] == 'done' and not math.isinf(record['replay_time'])]
+        best = min(finished, key=lambda record: (record['replay_time'], record['c_r'] or 0), default=None)
+        if best is not None:
+            with open(best['plan_path'], 'rb') as plan_file:
+                best_tree = pkl.load(plan_file)
+        for record in records:
+            record.pop('plan_path', None)
+
+    if verbose:
+        for record in records:
+            print(record)
+    if record_path is not None:
+        with open(record_path, 'w') as record_file:
+            json.dump(dict(cache_size=ex_tree.cache_size, deadline=deadline,
+                           best=best and best['planner'], planners=records), record_file, indent=2)
+    return best_tree, records
@@ -23,25 +23,147 @@ import pickle as pkl
 
 import sciunit_tree
 import ExecutionTree as exT
-from algorithms import pc
+from portfolio import plan_tree, portfolio, cached_plan
+from algorithms import priority_order, min_cache_size, pc_tiers
+from versions import versions_in_budget
+from util import IOCost, Tier, replay_time
+from plan_cache import PlanCache
 
 
-def replay_sequence(tree_binary, cache_size, replay_order_binary):
-    sciunit_execution_tree, _ = sciunit_tree.tree_load(tree_binary)
+USAGE = (f'Usage replay-order.py {"|".join(plan_tree.map)} <cache_size> <input tree.bin> <output replay-order.bin>\n'
+         f'      replay-order.py portfolio <cache_size> <input tree.bin> <output replay-order.bin> '
+         f'<deadline seconds>\n'
+         f'      replay-order.py min-cache <target cost | percent of the cost without cache%> <input tree.bin> '
+         f'[<output replay-order.bin>]\n'
+         f'Add --versions=<leaf hash or index>,... to plan and replay only those versions\n'
+         f'Add --priorities=<leaf hash or index>:<weight>,... to replay the weighted versions first\n'
+         f'Add --io=<dump bytes/s>,<restore bytes/s>,<dump latency>,<restore latency> to plan for checkpoint I/O\n'
+         f'Add --dedup to keep checkpoint pages once and plan by the bytes they do not share with their parents\n'
+         f'Add --budget=<seconds> to replay only the most versions that fit in that time\n'
+         f'Add --tiers=<name>:<capacity>:<directory>[:<dump bytes/s>/<restore bytes/s>/<dump latency>/'
+         f'<restore latency>],... to plan with pc over the capacity of every tier and keep each checkpoint on one\n'
+         f'Add --no-plan-cache to plan again even if the same inputs were planned before')
+
+
+def parse_target(tree, target):
+    """Leaf identifier for a hex hash of a node in tree, otherwise the index of a leaf in DFS order"""
+    try:
+        if tree.contains(bytes.fromhex(target)):
+            return bytes.fromhex(target)
+    except ValueError:
+        pass
+    return int(target)
+
+
+def parse_tiers(tiers, cost_model=None):
+    """Tiers given as name:capacity:directory[:io],..., with io like --io but separated by /.
+    A tier without io uses cost_model."""
+    parsed = []
+    for tier in tiers.split(','):
+        name, capacity, directory, *io = tier.split(':')
+        parsed.append(Tier(name, float(capacity), IOCost(*map(float, io[0].split('/'))) if io else cost_model,
+                           directory))
+    return parsed
+
+
+def load_tree(tree_binary, cache_size, targets=None, cost_model=None, dedup=False):
+    """Tree to plan with the cache size and cost model, pruned to the root paths of targets if given"""
     tree = exT.create_tree('SCIUNIT', tree_binary)
     tree.cache_size = cache_size
-    pc(tree)
+    if targets:
+        tree = tree.prune([parse_target(tree, target) for target in targets])
+    tree.cost_model = cost_model
+    tree.dedup = dedup
+    return tree
+
+
+def replay_sequence(tree_binary, cache_size, replay_order_binary, planner='pc', targets=None, priorities=None,
+                    cost_model=None, dedup=False, time_budget=None, plan_cache=None, tiers=None):
+    assert not priorities or (planner == 'pc' and not tiers), 'Priorities reorder the plan of pc without tiers'
+    sciunit_execution_tree, _ = sciunit_tree.tree_load(tree_binary)
+    tree = load_tree(tree_binary, cache_size, targets, cost_model, dedup)
+    if time_budget is not None:
+        # Versions are picked by the replay time of the planner that makes the final plan. priority_order
+        # only reorders PC's plan, so it takes as long as PC's.
+        if not tiers and planner == 'pc':
+            budget_planner = None
+        elif tiers:
+            def budget_planner(version_tree):
+                pc_tiers(version_tree, tiers)
+        else:
+            def budget_planner(version_tree):
+                plan_tree(planner, version_tree)
+        leaves, tree = versions_in_budget(tree, time_budget, planner=budget_planner)
+        assert tree is not None, 'No version fits in the time budget'
+        print(f'Replaying {len(leaves)} versions', [leaf.identifier.hex() for leaf in leaves])
+        tree.reset()
+    if priorities:
+        priority_order(tree, {tree.get_node(identifier) if not isinstance(identifier, int)
+                              else tree.path_index().leaves[identifier]: weight
+                              for identifier, weight in ((parse_target(tree, target), float(weight))
+                                                         for target, weight in priorities)})
+        print({leaf.identifier: finish for leaf, finish in tree.leaf_finish.items()})
+    elif tiers:
+        assert planner == 'pc', 'Tiers are planned with pc'
+        pc_tiers(tree, tiers)
+        print(f'Planned for {tree.cache_size:.0f} bytes, replaying in {replay_time(tree)} with the tiers',
+              {tier.name: sum(1 for placed in tree.checkpoint_tiers.values() if placed is tier) for tier in tiers})
+    else:
+        tree = cached_plan(planner, tree, plan_cache)
+    if time_budget is not None:
+        assert replay_time(tree) <= time_budget, f'The plan takes {replay_time(tree)} to replay, over the budget'
+    with open(replay_order_binary, 'wb') as robf:
+        pkl.dump((sciunit_execution_tree, tree), robf)
+
+
+def portfolio_sequence(tree_binary, cache_size, replay_order_binary, deadline, targets=None, cost_model=None,
+                       dedup=False):
+    """Replay sequence from the best planner of the portfolio, with its comparison record next to it"""
+    sciunit_execution_tree, _ = sciunit_tree.tree_load(tree_binary)
+    tree = load_tree(tree_binary, cache_size, targets, cost_model, dedup)
+    tree, _ = portfolio(tree, deadline, record_path=f'{replay_order_binary}.json', verbose=True)
+    assert tree is not None, 'No planner finished before the deadline'
     with open(replay_order_binary, 'wb') as robf:
         pkl.dump((sciunit_execution_tree, tree), robf)
 
 
+def min_cache_sequence(tree_binary, target, replay_order_binary=None, targets=None, cost_model=None, dedup=False):
+    """Smallest cache size reaching target, a cost or a percentage of the cost without cache, and its replay
+    sequence"""
+    sciunit_execution_tree, _ = sciunit_tree.tree_load(tree_binary)
+    tree = load_tree(tree_binary, 0, targets, cost_model, dedup)
+    if target.endswith('%'):
+        point = min_cache_size(tree, fraction=float(target[:-1]) / 100)
+    else:
+        point = min_cache_size(tree, target_cost=float(target))
+    assert point is not None, 'The target cost cannot be reached with any cache size'
+    print(f'Cache size {point.cache_size:.0f} bytes for cost {point.total_cost} with {point.c_r} checkpoints')
+    if replay_order_binary is not None:
+        with open(replay_order_binary, 'wb') as robf:
+            pkl.dump((sciunit_execution_tree, tree), robf)
+
+
 if __name__ == '__main__':
-    if len(sys.argv) < 5:
-        print('Usage replay-order.py pc|prpv1|prpv2|lfu <cache_size> <input tree.bin> <output replay-order.bin>')
+    options = dict(arg[2:].partition('=')[::2] for arg in sys.argv if arg.startswith('--'))
+    argv = [arg for arg in sys.argv if not arg.startswith('--')]
+    targets = options['versions'].split(',') if 'versions' in options else None
+    priorities = [priority.rsplit(':', 1) for priority in options['priorities'].split(',')] \
+        if 'priorities' in options else None
+    cost_model = IOCost(*map(float, options['io'].split(','))) if 'io' in options else None
+    dedup = 'dedup' in options
+    time_budget = float(options['budget']) if 'budget' in options else None
+    tiers = parse_tiers(options['tiers'], cost_model) if 'tiers' in options else None
+    plan_cache = None if 'no-plan-cache' in options else PlanCache()
+    if len(argv) < 5 and not (argv[1:2] == ['min-cache'] and len(argv) >= 4):
+        print(USAGE)
+        sys.exit(1)
 
-    if sys.argv[1] in ['pc']:
-        replay_sequence(sys.argv[3], float(sys.argv[2]), sys.argv[4])
-    elif sys.argv[1] in ['prpv1', 'prpv2', 'lfu']:
-        raise NotImplementedError(f'{sys.argv[1]} Replay Order Not Implemented')
+    if argv[1] == 'min-cache' and len(argv) >= 4:
+        min_cache_sequence(argv[3], argv[2], argv[4] if len(argv) > 4 else None, targets, cost_model, dedup)
+    elif argv[1] in plan_tree.map:
+        replay_sequence(argv[3], float(argv[2]), argv[4], argv[1], targets, priorities, cost_model, dedup,
+                        time_budget, plan_cache, tiers)
+    elif argv[1] == 'portfolio' and len(argv) > 5:
+        portfolio_sequence(argv[3], float(argv[2]), argv[4], float(argv[5]), targets, cost_model, dedup)
     else:
-        print('Usage replay-order.py pc|prpv1|prpv2|lfu <cache_size> <input tree.bin> <output replay-order.bin>')
+        print(USAGE)
@@ -33,36 +33,65 @@ import inspect
 import psutil
 
 from runner_util import *
+from util import replay_ops, prefetch
+from algorithms import pc_stream
+import sciunit_tree
+import ExecutionTree as exT
+from page_store import store_image, load_image, unload_image, delete_image
 import runner as runner_import
 
 
-def delete_checkpoint(hash_directory):
-    directory = base64.b64encode(hash_directory).decode().replace('/', '_')
-    shutil.rmtree(directory, ignore_errors=True)
+def checkpoint_directory(hash_directory, base='.'):
+    return os.path.join(base, base64.b64encode(hash_directory).decode().replace('/', '_'))
 
 
-def criu_dump(pid, hash_directory, waiter=None):
-    delete_checkpoint(hash_directory)
-    directory = base64.b64encode(hash_directory).decode().replace('/', '_')
-    os.mkdir(directory)
+def tier_directory(tree, identifier):
+    """Directory of the tier the checkpoint of identifier is placed on by pc_tiers"""
+    tier = (getattr(tree, 'checkpoint_tiers', None) or {}).get(identifier)
+    return tier.directory if tier is not None else '.'
+
+
+def page_store(base='.'):
+    """Directory of the pages kept once for every deduplicated checkpoint under base"""
+    return os.path.join(base, 'pages')
+
+
+def delete_checkpoint(hash_directory, base='.', dedup=False):
+    directory = checkpoint_directory(hash_directory, base)
+    if dedup:
+        delete_image(directory, page_store(base))
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def criu_dump(pid, hash_directory, waiter=None, base='.', dedup=False):
+    delete_checkpoint(hash_directory, base, dedup)
+    directory = checkpoint_directory(hash_directory, base)
+    os.makedirs(directory)
     os.system(f'sudo criu dump -t {pid} --shell-job -D {directory}/')
     if waiter is not None:
         waiter.wait()
     while psutil.pid_exists(pid):
         time.sleep(1)
     time.sleep(2)
+    if dedup:
+        store_image(directory, page_store(base))
 
 
-def criu_restore(pid, hash_directory):
+def criu_restore(pid, hash_directory, base='.', dedup=False):
     while psutil.pid_exists(pid):
         time.sleep(1)
-    directory = base64.b64encode(hash_directory).decode().replace('/', '_')
+    directory = checkpoint_directory(hash_directory, base)
+    if dedup:
+        load_image(directory)
     # os.system(f'sudo criu restore --shell-job -D {directory}/ &')
     runner = subprocess.Popen(['sudo', 'criu', 'restore', '--shell-job', '-D', f'{directory}/'], start_new_session=True)
     while not psutil.pid_exists(pid):
         time.sleep(1)
     signal.pause()
     signal.pause()
+    if dedup:
+        unload_image(directory)
     return runner
 
 
@@ -84,14 +113,32 @@ def run_code(server, pid, code):
 
 
 def make_code_map(node, code_map):
-    code_map[node.hash] = node.code
-    for child in node.children:
-        make_code_map(node.children[child], code_map)
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        code_map[node.hash] = node.code
+        stack.extend(node.children.values())
 
 
 def replay(replay_order_binary):
     with open(replay_order_binary, 'rb') as robf:
         sciunit_execution_tree, tree = pkl.load(robf)
+    replay_steps(sciunit_execution_tree, tree, replay_ops(tree))
+
+
+def replay_stream(tree_binary, cache_size, lookahead=10000):
+    """Replay the tree in tree_binary while it is still being planned with algorithms.pc_stream.
+    Trees of at most lookahead nodes are planned with PC before the replay starts, an infinite lookahead
+    always does that."""
+    sciunit_execution_tree, _ = sciunit_tree.tree_load(tree_binary)
+    tree = exT.create_tree('SCIUNIT', tree_binary)
+    tree.cache_size = cache_size
+    replay_steps(sciunit_execution_tree, tree, prefetch(pc_stream(tree, lookahead=lookahead)))
+    print(f'Planned cost = {tree.total_cost}')
+
+
+def replay_steps(sciunit_execution_tree, tree, steps):
+    """Run steps in the form of util.replay_ops for tree, which may still be produced while they run"""
     start = time.time()
 
     code_map = {}
@@ -119,32 +166,34 @@ def replay(replay_order_binary):
     runner = criu_restore(runner_pid, tree.root)
     print('First Restore Done')
 
-    def rec_run(node, cache=tree.cache_size, create=None):
-        nonlocal runner
-        if create is None:
-            create = [node]
-
-        for child, to_cache in node.data.recursive_cache[cache]:
-            if child is node:
-                restore, *run = create
-                criu_dump(runner_pid, b'criu', runner)
-                runner = criu_restore(runner_pid, restore.identifier)
-                for r in run:
-                    print(run_code(server, runner_pid, code_map[r.identifier]))
-            else:
-                if to_cache:
-                    criu_dump(runner_pid, node.identifier, runner)
-                    runner = criu_restore(runner_pid, node.identifier)
-                    rec_run(child, cache - node.data.c_size, [node, child])
-                else:
-                    rec_run(child, cache, create + [child])
-
-    rec_run(tree.get_node(tree.root))
+    dedup = getattr(tree, 'dedup', False)
+    for op, node in steps:
+        base = tier_directory(tree, node.identifier)
+        # The root is dumped in full before the replay starts
+        node_dedup = dedup and node.identifier != tree.root
+        if op == 'restore':
+            criu_dump(runner_pid, b'criu', runner)
+            runner = criu_restore(runner_pid, node.identifier, base, node_dedup)
+        elif op == 'run':
+            print(run_code(server, runner_pid, code_map[node.identifier]))
+        elif op == 'checkpoint':
+            criu_dump(runner_pid, node.identifier, runner, base, node_dedup)
+            runner = criu_restore(runner_pid, node.identifier, base, node_dedup)
+        elif op == 'evict' and node.identifier != tree.root:
+            # The root's image is kept, since every redo from the root restores it
+            delete_checkpoint(node.identifier, base, node_dedup)
+
     os.system(f'sudo kill -KILL {runner_pid}')
     print(f'Total Time = {time.time() - start}')
 
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print('Usage: replay.py replay-order.bin')
-    replay(sys.argv[1])
+        print('Usage: replay.py replay-order.bin\n'
+              '       replay.py --stream <cache_size> <input tree.bin> [<lookahead nodes>]\n'
+              'Streaming starts replaying before a tree of more than lookahead nodes (10000 by default) is\n'
+              'planned, at a cost that can be far above PC\'s plan. A lookahead of inf replays PC\'s plan.')
+    elif sys.argv[1] == '--stream':
+        replay_stream(sys.argv[3], float(sys.argv[2]), *map(float, sys.argv[4:5]))
+    else:
+        replay(sys.argv[1])
@@ -30,6 +30,7 @@ import nbformat
 from IPython.core import interactiveshell
 
 import sciunit_tree
+from page_store import image_pages, shared_bytes
 
 
 @contextmanager
@@ -66,6 +67,7 @@ def criu_run(path, tree):
         sys.exit(0)
 
     else:
+        parent_pages = None
         for i, cell in enumerate(nb.cells):
             _, tree = tree.traverse(cell.source)
 
@@ -80,6 +82,11 @@ def criu_run(path, tree):
                 for file in files:
                     size += os.path.getsize(os.path.join(path, file))
             tree.size = size
+            # Pages shared with the checkpoint of the previous cell, which is the parent in the tree
+            pages = image_pages(CRIU_IMAGE_PATH)
+            tree.shared_size = shared_bytes(pages, parent_pages)
+            tree.unique_size = size - tree.shared_size
+            parent_pages = pages
             os.system(f'sudo rm -rf {CRIU_IMAGE_PATH}')
             os.kill(pid, signal.SIGCONT)
 
@@ -19,15 +19,16 @@
 # Usage: For Bob to generate replay sequences using the mentioned algorithms.
 
 import shutil
+from collections import defaultdict as ddict
 
 from pyomo.environ import *
 
-from util import dfs_cost
-from algorithms import prp_v1
+from util import dfs_cost, dfs_schedule, post_order
+from algorithms import prp_v1, dfs_incumbent
 
 
-def _couenne_solve(model, verbose=False):
-    """Solve a given model using Couenne"""
+def _couenne_solve(model, verbose=False, time_limit=None):
+    """Solve a given model using Couenne, keeping the initial values when no solution is found in time_limit"""
     if not shutil.which('couenne'):
         if not hasattr(_couenne_solve, 'couenne_path'):
             print('Couenne not in PATH.')
@@ -36,30 +37,42 @@ def _couenne_solve(model, verbose=False):
         _couenne_solve.couenne_path = None
 
     opt = SolverFactory('couenne', executable=_couenne_solve.couenne_path)
+    if time_limit is not None:
+        opt.options['time_limit'] = time_limit
+
+    results = opt.solve(model, tee=verbose, load_solutions=False)
+    if len(results.solution):
+        model.solutions.load_from(results)
+    return results
+
+
+def optimal_dfs(ex_tree, verbose=False, time_limit=None):
+    """Create a Pyomo model for the optimal DFS problem, warm started from the dfs_incumbent, and solve it"""
+    _, cached = dfs_incumbent(ex_tree)
+    for node in cached:
+        node.data.x_in_cache = True
+    dfs_cost(ex_tree)
+    y_start = {node.identifier: node.data.y for node in ex_tree.all_nodes_itr()}
+    ex_tree.reset()
 
-    model.solutions.load_from(opt.solve(model, tee=verbose))
-
-
-def optimal_dfs(ex_tree, verbose=False):
-    """Create a Pyomo model for the optimal DFS problem and solve it"""
     nodes_list = ex_tree.all_nodes()
     nodes = {node.identifier: (i + 1, node) for i, node in enumerate(nodes_list)}
-    paths = ex_tree.paths_to_leaves()
+    index = ex_tree.path_index()
 
     model = AbstractModel()
 
     # Pyomo Sets are 1-indexed: valid index values for Sets are [1 .. len(Set)]
     # so all indexes have to be subtracted from 1 for ex_tree
     model.i = RangeSet(1, len(nodes))
-    model.j = RangeSet(1, len(paths))
+    model.j = RangeSet(1, len(index.leaves))
 
-    model.x = Var(model.i, domain=Boolean, initialize=lambda *_: 0)
-    model.y = Var(model.i, within=PositiveIntegers, initialize=lambda *_: 1)
+    model.x = Var(model.i, domain=Boolean, initialize=lambda m, i: int(nodes_list[i - 1] in cached))
+    model.y = Var(model.i, within=PositiveIntegers, initialize=lambda m, i: y_start[nodes_list[i - 1].identifier])
 
     model.paths = Constraint(model.j,
                              rule=lambda m, j: inequality(0,
-                                                          sum(nodes[k][1].data.c_size * m.x[nodes[k][0]]
-                                                              for k in paths[j - 1]),
+                                                          sum(node.data.c_size * m.x[nodes[node.identifier][0]]
+                                                              for node in index.path(index.leaves[j - 1])),
                                                           ex_tree.cache_size))
 
     @model.Constraint(model.i)
@@ -78,7 +91,7 @@ def optimal_dfs(ex_tree, verbose=False):
                                           for i, node in nodes.values()),
                                  sense=minimize)
 
-    _couenne_solve(model, verbose)
+    ex_tree.solver_results = _couenne_solve(model, verbose, time_limit)
 
     if verbose:
         model.x.display()
@@ -89,83 +102,103 @@ def optimal_dfs(ex_tree, verbose=False):
         ex_tree.show(data_property='x_in_cache')
 
 
-def optimal(ex_tree, verbose=False):
-    """Create a Pyomo model for the optimal problem and solve it"""
+def _replay_windows(ex_tree, max_time):
+    """Time steps each node can be computed or held in cache at in an optimal replay of max_time steps.
+    A node needs all its ancestors computed before it, and every useful computation of a node is
+    followed by a chain of computations down to a leaf, so node can only be computed in the window
+    [depth + 1, max_time - distance to its nearest leaf]. Only a node with children is worth holding,
+    during the same window."""
+    nearest_leaf = {}
+    for node in post_order(ex_tree):
+        children = ex_tree.children(node.identifier)
+        nearest_leaf[node] = 1 + min(nearest_leaf[child] for child in children) if children else 0
+    return {node: range(ex_tree.depth(node) + 1, max_time - nearest_leaf[node] + 1)
+            for node in ex_tree.all_nodes_itr()}
+
+
+def optimal(ex_tree, verbose=False, time_limit=None):
+    """Create a compact Pyomo model for the optimal problem, warm started from the dfs_incumbent, and solve it.
+    Variables exist only for the (node, time) pairs in _replay_windows and all constraints are linear.
+    With time_limit, the best solution found by then is kept, or the warm start if there is none."""
+    _, cached = dfs_incumbent(ex_tree)
+    for node in cached:
+        node.data.x_in_cache = True
+    steps, held = dfs_schedule(ex_tree)
+    ex_tree.reset()
     prp_v1(ex_tree, verbose)
-    max_time = dfs_cost(ex_tree, force_cost=1)
+    max_time = max(dfs_cost(ex_tree, force_cost=1), len(steps))
     ex_tree.reset()
     if verbose:
         print(f'Max Time: {max_time}')
 
     nodes_list = ex_tree.all_nodes()
     nodes = {node.identifier: (i + 1, node) for i, node in enumerate(nodes_list)}
+    windows = _replay_windows(ex_tree, max_time)
 
-    model = AbstractModel()
+    p_index = [(i, t) for i, node in nodes.values() for t in windows[node]]
+    x_index = [(i, t) for i, node in nodes.values() if not node.is_leaf() for t in windows[node]]
+    p_start = {(nodes[node.identifier][0], t) for t, node in enumerate(steps, 1)}
+    x_start = {(nodes[node.identifier][0], t)
+               for node, (first, last) in held.items() for t in range(first, last + 1)}
+    p_at, x_at = ddict(list), ddict(list)
+    for i, t in p_index:
+        p_at[t].append(i)
+    for i, t in x_index:
+        x_at[t].append(i)
+
+    model = ConcreteModel()
 
     # Pyomo Sets are 1-indexed: valid index values for Sets are [1 .. len(Set)]
     # so all indexes have to be subtracted from 1 for ex_tree
-    model.t = RangeSet(0, max_time)
     model.i = RangeSet(1, len(nodes))
+    model.P = Set(initialize=p_index, dimen=2)
+    model.X = Set(initialize=x_index, dimen=2)
 
-    model.x = Var(model.i, model.t, domain=Boolean, initialize=lambda *_: 0)
-    model.p = Var(model.i, model.t, domain=Boolean, initialize=lambda *_: 0)
-
-    model.x_time_0_constraint = Constraint(model.i, rule=lambda m, i: m.x[i, 0] == 0)
-    model.p_time_0_constraint = Constraint(model.i, rule=lambda m, i: m.p[i, 0] == 0)
+    model.p = Var(model.P, domain=Boolean, initialize={key: int(key in p_start) for key in p_index})
+    model.x = Var(model.X, domain=Boolean, initialize={key: int(key in x_start) for key in x_index})
 
     # Constraint to make sure cache is not over-filled at any time
-    model.cache_size_constraint = Constraint(model.t,
-                                             rule=lambda m, time: inequality(0,
-                                                                             sum(m.x[i, time] * node.data.c_size
-                                                                                 for i, node in nodes.values()),
-                                                                             ex_tree.cache_size))
+    model.cache_size_constraint = Constraint(sorted(x_at),
+                                             rule=lambda m, time: sum(m.x[i, time] * nodes_list[i - 1].data.c_size
+                                                                      for i in x_at[time]) <= ex_tree.cache_size)
     # Constraint to produce only one thing at a time step
-    model.produce_one_thing_constraint = Constraint(model.t,
-                                                    rule=lambda m, time: inequality(0,
-                                                                                    sum(m.p[i, time]
-                                                                                        for i, _ in nodes.values()),
-                                                                                    1))
+    model.produce_one_thing_constraint = Constraint(sorted(p_at),
+                                                    rule=lambda m, time: sum(m.p[i, time] for i in p_at[time]) <= 1)
     # Constraint to produce everything at least once
     model.produce_everything_constraint = Constraint(model.i,
                                                      rule=lambda m, i: sum(m.p[i, t]
-                                                                           for t in range(1, 1 + max_time)) >= 1)
+                                                                           for t in windows[nodes_list[i - 1]]) >= 1)
 
     # Constraint to make sure an element is in cache only if it was previously in cache or generated now
-    model.cache_consistency_constraint = Constraint(model.i,
-                                                    rule=lambda m, i: sum(m.x[i, t] *
-                                                                          (1 - m.x[i, t - 1]) *
-                                                                          (1 - m.p[i, t])
-                                                                          for t in range(1, 1 + max_time)) == 0)
-
-    # Constraint to make sure an element can be generated only if parent in cache or generated previously
-    @model.Constraint(model.i)
-    def parent_present_constraint(m, i):
+    model.cache_consistency_constraint = Constraint(model.X,
+                                                    rule=lambda m, i, t: m.x[i, t] <= (m.x[i, t - 1]
+                                                                                       if (i, t - 1) in m.X else 0)
+                                                                                      + m.p[i, t])
+
+    # Constraint to make sure an element can be generated only if parent in cache or generated previously.
+    # The parent's window always holds t - 1 when the node's window holds t.
+    @model.Constraint(model.P)
+    def parent_present_constraint(m, i, t):
         if i == nodes[ex_tree.root][0]:
-            return Constraint.Feasible
-        else:
-            p = nodes[ex_tree.parent(nodes_list[i - 1].identifier).identifier][0]
-            return sum(m.p[i, t] * (1 - m.x[p, t - 1]) * (1 - m.p[p, t - 1])
-                       for t in range(1, 1 + max_time)) == 0
-
-    model.construct()
+            return Constraint.Skip
+        p = nodes[ex_tree.parent(nodes_list[i - 1].identifier).identifier][0]
+        return m.p[i, t] <= m.x[p, t - 1] + m.p[p, t - 1]
 
     if verbose:
         model.pprint()
 
-    model.total_cost = Objective(expr=sum(node.data.r_cost * model.p[i, t]
-                                          for t in range(1, 1 + max_time)
-                                          for i, node in nodes.values()),
+    model.total_cost = Objective(expr=sum(nodes_list[i - 1].data.r_cost * model.p[i, t] for i, t in p_index),
                                  sense=minimize)
 
-    _couenne_solve(model, verbose)
+    ex_tree.solver_results = _couenne_solve(model, verbose, time_limit)
 
     if verbose:
         model.x.display()
         model.p.display()
 
     for i, node in nodes.values():
-        node.data.x_in_cache = [bool(round(model.x[i, t].value)) for t in range(1 + max_time)]
-        node.data.p_computed = [bool(round(model.p[i, t].value)) for t in range(1 + max_time)]
+        node.data.x_in_cache = [(i, t) in model.X and bool(round(model.x[i, t].value)) for t in range(1 + max_time)]
+        node.data.p_computed = [(i, t) in model.P and bool(round(model.p[i, t].value)) for t in range(1 + max_time)]
     if verbose:
         ex_tree.show(data_property='x_in_cache')
         ex_tree.show(data_property='p_computed')
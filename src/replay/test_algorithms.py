@@ -0,0 +1,127 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: Regression tests for the planners.
+# Usage: python -m pytest in src/replay.
+
+import time
+import tracemalloc
+
+import ExecutionTree as exT
+import algorithms
+from util import IOCost, Tier, import_plans, replay_ops, replay_time
+
+
+def chain_tree(depth, branch_every=100, cache_size=20):
+    """Chain of depth cells with a side branch every branch_every cells, like a long notebook edited a few times"""
+    tree = exT.ExecutionTree()
+    tree.create_node('n0', 'n0', data=exT.NodeData(1, 1))
+    for i in range(1, depth):
+        tree.create_node(f'n{i}', f'n{i}', parent=f'n{i - 1}', data=exT.NodeData(1, 1))
+        if i % branch_every == 0:
+            tree.create_node(f's{i}', f's{i}', parent=f'n{i - 1}', data=exT.NodeData(1, 1))
+    tree.cache_size = cache_size
+    return tree
+
+
+def test_pc_deep_chain_time():
+    tree = chain_tree(5000)
+    start = time.monotonic()
+    total_cost = algorithms.pc(tree)
+    assert time.monotonic() - start < 5
+    assert total_cost == replay_time(tree)
+
+
+def test_pc_deep_chain_memory():
+    tree = chain_tree(2000)
+    tracemalloc.start()
+    try:
+        algorithms.pc(tree)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # A memo growing with the depth of every hit takes hundreds of megabytes here
+    assert peak < 64 * 1024 ** 2
+
+
+def test_pc_memo_limit():
+    tree = exT.create_tree('KARY', 3, 5)
+    tree.cache_size = 7
+    total_cost = algorithms.pc(tree, memo_limit=20)
+    assert len(tree.memo.entries) <= 20 and tree.memo.evictions
+    assert total_cost == replay_time(tree)
+
+
+def test_pc_tiers_not_worse_than_one_tier():
+    ram, ssd = Tier('ram', 4, IOCost(100, 100, 0.1, 0.1)), Tier('ssd', 12, IOCost(2, 3, 1, 1))
+    tree = exT.create_tree('KARY', 3, 4)
+    tree.cost_model = ssd.cost_model
+    single_costs = []
+    for tier in (ram, ssd):
+        tree.reset()
+        tree.cache_size = tier.capacity
+        tree.checkpoint_tiers = {node.identifier: tier for node in tree.all_nodes_itr()
+                                 if node.identifier != tree.root}
+        algorithms.pc(tree)
+        single_costs.append(replay_time(tree))
+    tree.reset()
+    total_cost = algorithms.pc_tiers(tree, [ram, ssd])
+    assert total_cost == replay_time(tree)
+    assert total_cost <= min(single_costs)
+
+
+def test_priority_order_keeps_pc_cost():
+    tree = exT.create_tree('KARY', 3, 4)
+    tree.cache_size = 5
+    tree.cost_model = IOCost(2, 3, 1, 1)
+    pc_cost = algorithms.pc(tree)
+    tree.reset()
+    total_cost = algorithms.priority_order(tree)
+    assert total_cost == pc_cost
+    assert abs(replay_time(tree) - pc_cost) < 1e-9 * pc_cost
+
+
+def test_online_policies_match_replay_time():
+    tree = exT.create_tree('KARY', 3, 4)
+    tree.cache_size = 10
+    tree.cost_model = IOCost(2, 3, 1, 1)
+    for algorithm in (algorithms.lfu, algorithms.lru, algorithms.greedy_dual, algorithms.belady):
+        tree.reset()
+        total_cost = algorithm(tree)
+        assert abs(total_cost - replay_time(tree)) < 1e-9 * total_cost
+
+
+def test_pc_stream_within_lookahead_is_pc():
+    tree = exT.create_tree('KARY', 3, 4)
+    tree.cache_size = 5
+    pc_cost = algorithms.pc(tree)
+    tree.reset()
+    steps = list(algorithms.pc_stream(tree))
+    assert tree.total_cost == pc_cost
+    assert steps == list(replay_ops(tree))
+
+
+def test_pc_frontier_plans_replay_at_their_cost():
+    tree = exT.create_tree('KARY', 3, 5)
+    points = algorithms.pc_frontier(tree, [4, 7, 10, 7], granularity=2)
+    for point in points:
+        tree.reset()
+        tree.cache_size = point.cache_size
+        tree.granularity = 2
+        import_plans(tree, point.plans)
+        assert abs(replay_time(tree) - point.total_cost) < 1e-9 * point.total_cost
+    assert points[1].total_cost == points[3].total_cost
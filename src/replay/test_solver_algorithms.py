@@ -0,0 +1,105 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: Tests of the MINLP models, skipped without Pyomo, and the solves skipped without Couenne.
+# Usage: python -m pytest in src/replay.
+
+import shutil
+
+import pytest
+
+import ExecutionTree as exT
+import algorithms
+from util import dfs_cost
+
+pyomo = pytest.importorskip('pyomo.environ')
+import solver_algorithms  # noqa: E402
+
+needs_couenne = pytest.mark.skipif(shutil.which('couenne') is None, reason='Couenne is not in PATH')
+
+
+def tiny_tree():
+    """Root with a costly cell that two versions share, and a cheap third version"""
+    tree = exT.ExecutionTree()
+    for identifier, parent, r_cost, c_size in (('n0', None, 1, 1), ('n1', 'n0', 5, 2), ('n2', 'n1', 3, 2),
+                                               ('n3', 'n1', 2, 1), ('n4', 'n0', 1, 1)):
+        tree.create_node(identifier, identifier, parent=parent, data=exT.NodeData(r_cost, c_size))
+    tree.cache_size = 2
+    return tree
+
+
+def unsolved(monkeypatch):
+    """Models passed to the solver, which is replaced to keep the warm start"""
+    models = []
+    monkeypatch.setattr(solver_algorithms, '_couenne_solve',
+                        lambda model, verbose=False, time_limit=None: models.append(model))
+    return models
+
+
+def assert_feasible(model):
+    for constraint in model.component_data_objects(pyomo.Constraint, active=True):
+        body = pyomo.value(constraint.body)
+        assert constraint.lower is None or body >= pyomo.value(constraint.lower) - 1e-9, constraint.name
+        assert constraint.upper is None or body <= pyomo.value(constraint.upper) + 1e-9, constraint.name
+
+
+def fits(tree):
+    """Check that every path keeps at most the cache size in cache"""
+    return all(sum(node.data.c_size for node in path if node.data.x_in_cache) <= tree.cache_size
+               for path in tree.path_index().paths())
+
+
+def test_optimal_dfs_model_warm_start(monkeypatch):
+    models = unsolved(monkeypatch)
+    tree = tiny_tree()
+    incumbent_cost, cached = algorithms.dfs_incumbent(tree)
+    solver_algorithms.optimal_dfs(tree)
+    model, = models
+    assert len(model.x) == len(tree) and len(model.j) == len(tree.path_index().leaves)
+    assert_feasible(model)
+    assert {node for node in tree.all_nodes_itr() if node.data.x_in_cache} == cached
+    assert dfs_cost(tree) == incumbent_cost
+
+
+def test_optimal_model_warm_start(monkeypatch):
+    models = unsolved(monkeypatch)
+    tree = tiny_tree()
+    solver_algorithms.optimal(tree)
+    model, = models
+    # The warm start is the DFS schedule, which computes every node
+    assert all(any(node.data.p_computed) for node in tree.all_nodes_itr())
+    windows = solver_algorithms._replay_windows(tree, len(tree.get_node(tree.root).data.p_computed) - 1)
+    assert set(model.P) == {(i, t) for i, node in enumerate(tree.all_nodes(), 1) for t in windows[node]}
+    assert_feasible(model)
+
+
+@needs_couenne
+def test_optimal_dfs_not_worse_than_incumbent():
+    tree = tiny_tree()
+    incumbent_cost, _ = algorithms.dfs_incumbent(tree)
+    solver_algorithms.optimal_dfs(tree)
+    assert fits(tree)
+    assert dfs_cost(tree) <= incumbent_cost
+
+
+@needs_couenne
+def test_optimal_within_cache_size():
+    tree = tiny_tree()
+    solver_algorithms.optimal(tree)
+    for t in range(len(tree.get_node(tree.root).data.x_in_cache)):
+        assert sum(node.data.c_size for node in tree.all_nodes_itr() if node.data.x_in_cache[t]) <= tree.cache_size
+    assert all(any(node.data.p_computed) for node in tree.all_nodes_itr())
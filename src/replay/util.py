@@ -17,6 +17,12 @@
 
 # File purpose: Miscellaneous utility functions
 
+import gc
+import math
+import queue
+import threading
+from contextlib import contextmanager
+from collections import namedtuple
 from functools import singledispatch
 from itertools import islice
 
@@ -55,28 +61,270 @@ def create_registerer():
     return call, register_callee
 
 
+def run_recursion(recurse, *args, shortcut=None):
+    """Run a recursive generator function on an explicit stack instead of the Python call stack.
+    Rather than calling itself, recurse yields the arguments of each call it needs and is sent back the result.
+    Calls for which shortcut returns a value other than None are answered without starting a new frame."""
+    stack, result = [recurse(*args)], None
+    while stack:
+        try:
+            call = stack[-1].send(result)
+        except StopIteration as returned:
+            stack.pop()
+            result = returned.value
+        else:
+            if shortcut is None or (result := shortcut(*call)) is None:
+                stack.append(recurse(*call))
+    return result
+
+
+def prefetch(items):
+    """Iterate items while a thread keeps producing the next ones, so producing them overlaps with using them.
+    An exception raised while producing is raised again here, in order."""
+    ready = queue.Queue()
+
+    def produce():
+        try:
+            for item in items:
+                ready.put((True, item))
+            ready.put((False, None))
+        except Exception as error:
+            ready.put((False, error))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        more, item = ready.get()
+        if not more:
+            if item is not None:
+                raise item
+            return
+        yield item
+
+
+def post_order(ex_tree, node=None):
+    """Nodes of the subtree at node with every node after its children, without recursion"""
+    if node is None:
+        node = ex_tree.get_node(ex_tree.root)
+    stack = [(node, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            yield node
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(ex_tree.children(node.identifier)))
+
+
+class IOCost:
+    """Time to dump and restore a checkpoint with CRIU, a fixed latency plus its size over a bandwidth.
+    Set as ex_tree.cost_model for the planners to account for it. Any object with the same dump and
+    restore methods works too. Checkpoints of infinite size, like the root of a sciunit tree, are never
+    dumped by a plan and count latency only."""
+
+    def __init__(self, dump_bandwidth=math.inf, restore_bandwidth=math.inf, dump_latency=0, restore_latency=0):
+        self.dump_bandwidth = dump_bandwidth
+        self.restore_bandwidth = restore_bandwidth
+        self.dump_latency = dump_latency
+        self.restore_latency = restore_latency
+
+    @staticmethod
+    def _size(node):
+        return 0 if math.isinf(node.data.c_size) else node.data.c_size
+
+    def dump(self, ex_tree, node):
+        return self.dump_latency + self._size(node) / self.dump_bandwidth
+
+    def restore(self, ex_tree, node):
+        return self.restore_latency + self._size(node) / self.restore_bandwidth
+
+
+# A checkpoint storage tier, such as tmpfs or a local SSD, holding at most capacity along any path.
+# Checkpoints placed on it are dumped and restored under its cost model and kept in its directory.
+Tier = namedtuple('Tier', 'name capacity cost_model directory', defaults=(None, '.'))
+
+
+def _node_cost_model(ex_tree, node):
+    """Cost model of the tier node's checkpoint is placed on, otherwise ex_tree.cost_model"""
+    tier = (getattr(ex_tree, 'checkpoint_tiers', None) or {}).get(node.identifier)
+    return tier.cost_model if tier is not None else getattr(ex_tree, 'cost_model', None)
+
+
+def dump_cost(ex_tree, node):
+    """Time to dump node's checkpoint under its cost model, none without one"""
+    cost_model = _node_cost_model(ex_tree, node)
+    return cost_model.dump(ex_tree, node) if cost_model is not None else 0
+
+
+def restore_cost(ex_tree, node):
+    """Time to restore node's checkpoint under its cost model, none without one"""
+    cost_model = _node_cost_model(ex_tree, node)
+    return cost_model.restore(ex_tree, node) if cost_model is not None else 0
+
+
+def plan_io_cost(plan, dump, restore):
+    """Time replay_ops takes to dump and restore node's checkpoint for its plan, given the time of each.
+    The checkpoint is dumped for the first child that keeps it, and restored for every later child until
+    the first one that does not keep it, which frees its bytes."""
+    kept = sum(cached for child, cached in plan[1:] if child is not plan[0][0])
+    if not kept:
+        return 0
+    freed = any(not cached for child, cached in plan[1:] if child is not plan[0][0])
+    return dump + (kept - 1 + freed) * restore
+
+
+def op_cost(ex_tree, op, node):
+    """Time of a step from replay_ops"""
+    if op == 'run':
+        return node.data.r_cost
+    if op == 'checkpoint':
+        return dump_cost(ex_tree, node)
+    if op == 'restore':
+        return restore_cost(ex_tree, node)
+    return 0
+
+
+def step_costs(ex_tree):
+    """Steps of replay_ops with their op_cost, as (op, node, time) triples. Restoring the root also counts
+    its r_cost, like in total_cost, since it stands for running the root unless a plan checkpointed it."""
+    root = ex_tree.get_node(ex_tree.root)
+    root_kept = False
+    for op, node in replay_ops(ex_tree):
+        if node is root and op in ('checkpoint', 'evict'):
+            root_kept = op == 'checkpoint'
+        yield op, node, op_cost(ex_tree, op, node) + (root.data.r_cost if op == 'restore' and node is root
+                                                      and not root_kept else 0)
+
+
+def replay_time(ex_tree):
+    """Time to replay the plan with replay_ops, including checkpoint dumps and restores"""
+    return sum(seconds for _, _, seconds in step_costs(ex_tree))
+
+
 def dfs_cost(ex_tree, node=None, force_cost=None):
-    """Compute cost of computing entire tree recursively"""
+    """Compute cost of computing entire tree in post-order"""
     if node is None:
         ex_tree.total_r_cost = 0
         node = ex_tree.get_node(ex_tree.root)
-    for child in ex_tree.children(node.identifier):
-        dfs_cost(ex_tree, child, force_cost)
-    if node.is_leaf():
-        node.data.y = 1
-    else:
-        # compute y value for all children
-        node.data.y = 0  # reinitialize for repeated runs
-        for child in ex_tree.children(node.identifier):
-            node.data.y += 1 + (child.data.y - 1) * (1 - child.data.x_in_cache)
+    for node in post_order(ex_tree, node):
+        if node.is_leaf():
+            node.data.y = 1
+        else:
+            # compute y value for all children
+            node.data.y = 0  # reinitialize for repeated runs
+            for child in ex_tree.children(node.identifier):
+                node.data.y += 1 + (child.data.y - 1) * (1 - child.data.x_in_cache)
 
-    if not force_cost:
-        ex_tree.total_r_cost += node.data.r_cost * (1 + (node.data.y - 1) * (1 - node.data.x_in_cache))
-    else:
-        ex_tree.total_r_cost += force_cost * (1 + (node.data.y - 1) * (1 - node.data.x_in_cache))
+        if not force_cost:
+            ex_tree.total_r_cost += node.data.r_cost * (1 + (node.data.y - 1) * (1 - node.data.x_in_cache))
+        else:
+            ex_tree.total_r_cost += force_cost * (1 + (node.data.y - 1) * (1 - node.data.x_in_cache))
     return ex_tree.total_r_cost
 
 
+def dfs_saving(ex_tree, node):
+    """Reduction in DFS cost from caching node, using the y values left by dfs_cost"""
+    saving = node.data.r_cost
+    parent = ex_tree.parent(node.identifier)
+    while parent is not None and not parent.data.x_in_cache:
+        saving += parent.data.r_cost
+        parent = ex_tree.parent(parent.identifier)
+    return (node.data.y - 1) * saving
+
+
+def _cached_ancestor(ex_tree, node):
+    while node.identifier != ex_tree.root:
+        node = ex_tree.parent(node.identifier)
+        if node.data.x_in_cache:
+            break
+    return node
+
+
+def dfs_gain(ex_tree, node):
+    """Reduction in DFS replay time from caching node, using the y values left by dfs_cost.
+    Under a cost model the node is dumped once and restored instead of its nearest cached ancestor
+    for every path but the first below it."""
+    saving = dfs_saving(ex_tree, node)
+    if getattr(ex_tree, 'cost_model', None) is None:
+        return saving
+    return saving - dump_cost(ex_tree, node) - (node.data.y - 1) * (
+        restore_cost(ex_tree, node) - restore_cost(ex_tree, _cached_ancestor(ex_tree, node)))
+
+
+def dfs_io_cost(ex_tree):
+    """Time spent on dumps and restores of the DFS solution, using the y values left by dfs_cost"""
+    if getattr(ex_tree, 'cost_model', None) is None:
+        return 0
+    root = ex_tree.get_node(ex_tree.root)
+    return root.data.y * restore_cost(ex_tree, root) + sum(
+        dump_cost(ex_tree, node) + (node.data.y - 1) * restore_cost(ex_tree, node)
+        for node in ex_tree.all_nodes_itr() if node.data.x_in_cache and node is not root)
+
+
+def dfs_cache(ex_tree, node):
+    """Cache node and update y values along its ancestor chain instead of re-running dfs_cost"""
+    delta = 1 - node.data.y
+    node.data.x_in_cache = True
+    parent = ex_tree.parent(node.identifier)
+    while parent is not None:
+        parent.data.y += delta
+        if parent.data.x_in_cache:
+            break
+        parent = ex_tree.parent(parent.identifier)
+
+
+def dfs_uncache(ex_tree, node):
+    """Evict node and update y values along its ancestor chain, undoing dfs_cache"""
+    delta = node.data.y - 1
+    node.data.x_in_cache = False
+    parent = ex_tree.parent(node.identifier)
+    while parent is not None:
+        parent.data.y += delta
+        if parent.data.x_in_cache:
+            break
+        parent = ex_tree.parent(parent.identifier)
+
+
+def dfs_schedule(ex_tree):
+    """Replay the DFS solution in x_in_cache one computation per time step, starting at time 1.
+    Returns the node computed at every step, and the first and last step each cached node is held for.
+    A node that is not cached is recomputed, along with its uncached ancestors, for every child after the first."""
+    root = ex_tree.get_node(ex_tree.root)
+    steps = [root]
+    # Frames are (node, remaining children, nodes to recompute to get node back, whether node is current)
+    stack = [[root, iter(ex_tree.children(root.identifier)), [] if root.data.x_in_cache else [root], True]]
+    while stack:
+        frame = stack[-1]
+        node, children, redo, current = frame
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        if not current:
+            steps.extend(redo)
+        frame[3] = False
+        steps.append(child)
+        child_redo = [] if child.data.x_in_cache else redo + [child]
+        stack.append([child, iter(ex_tree.children(child.identifier)), child_redo, True])
+
+    held, first = {}, {}
+    for step, node in enumerate(steps, 1):
+        first.setdefault(node, step)
+        parent = ex_tree.parent(node.identifier)
+        if parent is not None and parent.data.x_in_cache:
+            held[parent] = first[parent], step - 1
+    return steps, held
+
+
+def leaf_finish(ex_tree):
+    """Time each leaf is done at when replaying with replay_ops, see op_cost"""
+    elapsed, finish = 0, {}
+    for op, node, seconds in step_costs(ex_tree):
+        elapsed += seconds
+        if op == 'run' and node.is_leaf():
+            finish[node] = elapsed
+    return finish
+
+
 def non_dfs_cost(ex_tree):
     """Compute the cost for a non-DFS solution"""
     return sum(node.data.r_cost * sum(node.data.p_computed) for node in ex_tree.all_nodes_itr())
@@ -89,18 +337,21 @@ def cost(ex_tree):
     elif ex_tree.get_node(ex_tree.root).data.recursive_cache:
         return ex_tree.total_cost
     else:
-        return dfs_cost(ex_tree)
+        return dfs_cost(ex_tree) + dfs_io_cost(ex_tree)
 
 
 def _min_max_depth(ex_tree, node=None):
     if node is None:
         node = ex_tree.root
-    depths = []
-    for child in ex_tree.children(node):
-        depths.extend(_min_max_depth(ex_tree, child.identifier))
-    if not depths:
-        return 1, 1
-    return 1 + min(depths), 1 + max(depths)
+    depths = {}
+    for tree_node in post_order(ex_tree, ex_tree.get_node(node)):
+        children = ex_tree.children(tree_node.identifier)
+        if not children:
+            depths[tree_node.identifier] = 1, 1
+        else:
+            depths[tree_node.identifier] = (1 + min(depths[child.identifier][0] for child in children),
+                                            1 + max(depths[child.identifier][1] for child in children))
+    return depths[node]
 
 
 def print_info(ex_tree, name=''):
@@ -124,25 +375,175 @@ def paths_to_leaves(ex_tree, node_path=None):
         node, path = ex_tree.get_node(ex_tree.root), []
     else:
         node, path = node_path
-    path.append(node)
-    if node.is_leaf():
-        yield path.copy()
-    else:
-        for child in ex_tree.children(node.identifier):
-            yield from paths_to_leaves(ex_tree, node_path=(child, path))
-    assert path.pop() == node
+    stack = [(node, len(path))]
+    while stack:
+        node, depth = stack.pop()
+        del path[depth:]
+        path.append(node)
+        if node.is_leaf():
+            yield path.copy()
+        else:
+            stack.extend((child, depth + 1) for child in reversed(ex_tree.children(node.identifier)))
+
+
+def quantize(value, granularity, rounding=math.ceil):
+    """Round value to a multiple of granularity, leaving it unchanged without a granularity"""
+    if not granularity or math.isinf(value):
+        return value
+    return rounding(value / granularity) * granularity
+
+
+def plan_size(ex_tree, node):
+    """Checkpoint size of node as accounted by the PC plan"""
+    return quantize(node.data.c_size, getattr(ex_tree, 'granularity', None), math.ceil)
+
+
+def plan_budget(ex_tree):
+    """Cache size at the root of the PC plan"""
+    return quantize(ex_tree.cache_size, getattr(ex_tree, 'granularity', None), math.floor)
+
+
+def plan_unique(ex_tree, node, rounding=math.ceil):
+    """Bytes of node's checkpoint not shared with its parent's as accounted by the PC plan, None unless
+    ex_tree.dedup is set. Nodes without a measurement in ex_tree.unique_sizes share nothing."""
+    if not getattr(ex_tree, 'dedup', False):
+        return None
+    unique_sizes = getattr(ex_tree, 'unique_sizes', None) or {}
+    return quantize(unique_sizes.get(node.identifier, node.data.c_size), getattr(ex_tree, 'granularity', None),
+                    rounding)
+
+
+def child_caches(cache, budget, size, unique=None):
+    """Cache left for the children of a node with and without the node kept in cache, the first None
+    if it does not fit. With unique, checkpoints are kept in a deduplicated store, where the first one
+    on a path takes its full size and every node below it its unique bytes, whether cached or not.
+    Those bound the bytes any later checkpoint adds to the ones above it. The cache only equals the
+    budget until a checkpoint is taken, and runs out at -1."""
+    if unique is None or cache == budget:
+        return (cache - size if cache >= size else None), cache
+    left = max(cache - unique, -1)
+    return (left if left >= 0 else None), left
+
+
+def plan_key(ex_tree, node, cache, cached):
+    """Cache left for a child of node, depending on whether node is kept in cache for it"""
+    with_node, without_node = child_caches(cache, plan_budget(ex_tree), plan_size(ex_tree, node),
+                                           plan_unique(ex_tree, node))
+    return with_node if cached else without_node
 
 
 def checkpoints_restores(ex_tree):
-    def recurse(node, cache):
-        cr = 0
+    cr = 0
+    stack = [(ex_tree.get_node(ex_tree.root), plan_budget(ex_tree))]
+    while stack:
+        node, cache = stack.pop()
         for child, p_in_c in node.data.recursive_cache[cache]:
             if p_in_c:
                 cr += 1
             if child is not node:
-                cr += recurse(child, cache - (node.data.c_size
-                                              if p_in_c else 0))
-        return cr
+                stack.append((child, plan_key(ex_tree, node, cache, p_in_c)))
+    return cr
+
+
+@contextmanager
+def paused_gc():
+    """Pause garbage collection while building many objects that are all kept"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def export_plans(ex_tree):
+    """PC plans of every node with nodes replaced by identifiers, so they can be pickled on their own"""
+    with paused_gc():
+        return {node.identifier: {cache: [(plan_node.identifier, cached) for plan_node, cached in plan]
+                                  for cache, plan in node.data.recursive_cache.items()}
+                for node in ex_tree.all_nodes_itr()}
+
+
+def export_walked_plans(ex_tree):
+    """The PC plans the replay walks, in the form of export_plans"""
+    plans = {}
+    stack = [(ex_tree.get_node(ex_tree.root), plan_budget(ex_tree))]
+    while stack:
+        node, cache = stack.pop()
+        plan = node.data.recursive_cache[cache]
+        plans.setdefault(node.identifier, {})[cache] = [(plan_node.identifier, cached) for plan_node, cached in plan]
+        stack.extend((child, plan_key(ex_tree, node, cache, cached)) for child, cached in plan[1:]
+                     if child is not node)
+    return plans
+
+
+def import_plans(ex_tree, plans):
+    """Load PC plans from export_plans into the matching nodes of ex_tree"""
+    nodes = {node.identifier: node for node in ex_tree.all_nodes_itr()}
+    with paused_gc():
+        for identifier, node_plans in plans.items():
+            nodes[identifier].data.recursive_cache = {
+                cache: [(nodes[plan_node], cached) for plan_node, cached in plan]
+                for cache, plan in node_plans.items()}
+
+
+def replay_ops(ex_tree):
+    """Steps to replay the PC plan in order, as ('checkpoint' | 'restore' | 'run' | 'evict', node) pairs.
+    A checkpoint is dumped and restored to keep running, a restore switches to a checkpointed node,
+    a run executes the node's cell on top of the current state and an evict deletes a checkpoint
+    that is not restored again.
+    The first child of a node continues from the node's state, later ones restore its checkpoint if it
+    is kept for them and redo the node otherwise, so the steps take the plan's total_cost."""
+    if getattr(ex_tree, 'online_ops', None) is not None:
+        yield from ex_tree.online_ops
+        return
 
-    return recurse(ex_tree.get_node(ex_tree.root), ex_tree.cache_size)
+    class Frame:
+        def __init__(self, node, cache, create, parent_redo):
+            # create is how to redo node, restoring the checkpoint above it and running the cells after it
+            self.node, self.cache = node, cache
+            self.redo = node.data.r_cost + parent_redo
+            self.create = create
+            self.entries = iter(node.data.recursive_cache[cache])
+            next(self.entries)
+            self.here = True
+            self.dumped = False
 
+    root = ex_tree.get_node(ex_tree.root)
+    yield 'restore', root
+    stack = [Frame(root, plan_budget(ex_tree), ['restore', root], restore_cost(ex_tree, root))]
+    while stack:
+        frame = stack[-1]
+        node = frame.node
+        child, to_cache = next(frame.entries, (None, None))
+        if child is None:
+            stack.pop()
+            if frame.dumped:
+                yield 'evict', node
+            if stack:
+                stack[-1].here = False
+            continue
+        if child is node:
+            start, restore, *run = frame.create
+            yield start, restore
+            for run_node in run:
+                yield 'run', run_node
+            frame.here = True
+            continue
+        if not frame.here:
+            # Restore node, which was dumped for an earlier child since only the first child can follow it
+            assert frame.dumped
+            yield 'restore', node
+            frame.here = True
+        if to_cache and not frame.dumped:
+            yield 'checkpoint', node
+            frame.dumped = True
+        elif not to_cache and frame.dumped:
+            # Its bytes go to this child
+            frame.dumped = False
+            yield 'evict', node
+        yield 'run', child
+        stack.append(Frame(child, plan_key(ex_tree, node, frame.cache, to_cache),
+                           ['restore', node, child] if to_cache else frame.create + [child],
+                           restore_cost(ex_tree, node) if to_cache else frame.redo))
\ No newline at end of file
@@ -0,0 +1,104 @@
+# CHEX - Multiversion Replay with Ordered Checkpoints
+# Copyright (c) 2020 DePaul University
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+# --------------------------------------------------------------------------------
+#
+# Author: Naga Nithin Manne <nithinmanne@gmail.com>
+
+# File purpose: Find the versions of a tree that can be replayed within a time budget.
+# Usage: For Bob to size a replay job to a fixed compute window.
+
+import numpy as np
+
+from algorithms import pc, pc_extend
+from util import replay_time, export_walked_plans, import_plans
+
+
+def version_order(ex_tree):
+    """Leaves in the order that grows the replayed tree the cheapest. Each next leaf is the one with the
+    least run time left on its path once the paths of the leaves before it are replayed."""
+    index = ex_tree.path_index()
+    paths = list(index.paths())
+    replayed = {ex_tree.get_node(ex_tree.root)}
+    left = set(range(len(paths)))
+    order = []
+    while left:
+        added = min(left, key=lambda leaf: (sum(node.data.r_cost for node in paths[leaf] if node not in replayed),
+                                            leaf))
+        left.remove(added)
+        replayed.update(paths[added])
+        order.append(index.leaves[added])
+    return order
+
+
+def _prefix_tree(ex_tree, leaves):
+    """ex_tree pruned to the paths of leaves, with its cost model"""
+    tree = ex_tree.prune(leaves)
+    tree.cost_model = getattr(ex_tree, 'cost_model', None)
+    return tree
+
+
+def _grow(ex_tree, order, verbose=False, planner=None):
+    """Tree with the paths of every prefix of order in turn, planned with planner, and its util.replay_time.
+    By default PC adds the paths one at a time with pc_extend, so the tree is planned once. Any other
+    planner, called with the tree, plans every prefix from scratch."""
+    if planner is None:
+        tree = _prefix_tree(ex_tree, order[:1])
+        pc(tree, verbose, incremental=True)
+        yield tree, replay_time(tree)
+        for leaf in order[1:]:
+            pc_extend(tree, tree.graft(ex_tree.prune([leaf])), verbose)
+            yield tree, replay_time(tree)
+        return
+    for end in range(1, len(order) + 1):
+        tree = _prefix_tree(ex_tree, order[:end])
+        planner(tree)
+        yield tree, replay_time(tree)
+
+
+def version_costs(ex_tree, order=None, verbose=False, planner=None):
+    """Time to replay the plan of every prefix of order, version_order by default, as an array.
+    The plans are made by planner, PC by default, and timed by util.replay_time."""
+    order = version_order(ex_tree) if order is None else order
+    return np.fromiter((cost for _, cost in _grow(ex_tree, order, verbose, planner)), float, len(order))
+
+
+def versions_for_budgets(costs, budgets):
+    """Number of versions that fit in every budget given the version_costs, for any number of budgets at once.
+    That is the longest prefix of the order whose cost is within the budget."""
+    # Costs are not always increasing, so a prefix fits if it or a longer one costs at most the budget
+    fits = np.minimum.accumulate(np.asarray(costs)[::-1])[::-1]
+    return np.searchsorted(fits, np.asarray(budgets), side='right')
+
+
+def versions_in_budget(ex_tree, budget, verbose=False, planner=None):
+    """Most versions that can be replayed within budget seconds at ex_tree.cache_size, taken in version_order,
+    as (leaves, tree). The tree has the paths of those leaves and is planned with planner, PC by default,
+    None if no version fits. Every prefix is planned once, like version_costs does."""
+    order = version_order(ex_tree)
+    # Costs are not always increasing, so the longest prefix that fits can follow ones that do not
+    count, fitting = 0, None
+    for end, (tree, cost) in enumerate(_grow(ex_tree, order, verbose, planner), 1):
+        if cost <= budget:
+            # PC grows a single tree, so only the plans its replay walks are kept from it
+            count, fitting = end, (tree if planner else (export_walked_plans(tree), tree.total_cost, tree.c_r))
+    if verbose:
+        print(f'{count} of {len(order)} versions fit in {budget}')
+    if not count:
+        return [], None
+    if planner is None:
+        plans, total_cost, c_r = fitting
+        fitting = _prefix_tree(ex_tree, order[:count])
+        import_plans(fitting, plans)
+        fitting.total_cost, fitting.c_r = total_cost, c_r
+    return order[:count], fitting